@@ -9,8 +9,12 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cinema.settings')
+django.setup(set_prefix=False)
 
-application = get_asgi_application()
+# the listing endpoints are served on the event loop, see ticket_office/asgi.py
+from ticket_office.asgi import AsyncReadHandler  # noqa: E402
+
+application = AsyncReadHandler()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ticket_office.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,13 +77,115 @@ WSGI_APPLICATION = 'cinema.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# SQLite by default, Postgres with CINEMA_DB_ENGINE=postgres. Connections are kept open and reused by
+# the requests of a worker thread for CINEMA_DB_CONN_MAX_AGE seconds instead of being opened for every
+# request, 0 goes back to one connection per request.
+
+CONN_MAX_AGE = int(os.environ.get('CINEMA_DB_CONN_MAX_AGE', 60))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # django.db.backends.sqlite3 taking the write lock when a transaction begins, see its docstring
+        'ENGINE': 'ticket_office.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # on disk rather than in memory, so tests running sales from several threads get real
+        # SQLite locking (writers wait for each other) instead of shared-cache "table is locked" errors,
+        # in the temp directory so its write-ahead log never lands in the checkout
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'cinema_test_db.sqlite3')},
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+    }
+}
+
+# Applied to every new SQLite connection by ticket_office.signals. Write-ahead logging lets readers carry
+# on while a sale writes, busy_timeout (ms) makes a sale queue for the write lock instead of failing with
+# "database is locked" (the 5s default is too short once a few dozen sales queue up on one showtime), and
+# synchronous=normal skips the fsync per commit: a power cut can lose the last sales, never corrupt the file.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'busy_timeout': 20000,
+    'synchronous': 'normal',
+}
+
+# Production profile. Exports stream their rows through server-side cursors; behind a transaction
+# pooling pgbouncer, which cannot keep them open, set CINEMA_DB_SERVER_SIDE_CURSORS=0.
+if os.environ.get('CINEMA_DB_ENGINE') == 'postgres':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('CINEMA_DB_NAME', 'cinema'),
+        'USER': os.environ.get('CINEMA_DB_USER', ''),
+        'PASSWORD': os.environ.get('CINEMA_DB_PASSWORD', ''),
+        'HOST': os.environ.get('CINEMA_DB_HOST', ''),
+        'PORT': os.environ.get('CINEMA_DB_PORT', ''),
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('CINEMA_DB_SERVER_SIDE_CURSORS', '1') == '0',
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# Local memory by default. Set CINEMA_CACHE_DIR to share one file based cache between all the worker
+# processes of a host, or CINEMA_MEMCACHED to memcached servers ("host:port", comma separated, needs the
+# python-memcached package) to share one between hosts.
+# Seat counters (ticket_office.seat_counters) need an atomic incr/decr shared by every process, which
+# only memcached gives: they refuse the other caches.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ticket-office',
     }
 }
 
+if os.environ.get('CINEMA_CACHE_DIR'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['CINEMA_CACHE_DIR'],
+    }
+
+if os.environ.get('CINEMA_MEMCACHED'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ['CINEMA_MEMCACHED'].split(','),
+    }
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'ticket_office.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+}
+
+
+# Requests slower than this many seconds are logged to ticket_office.slow_requests with their SQL,
+# None turns the slow request log off
+SLOW_REQUEST_SECONDS = None
+
+
+# Threads running the database work of the listing endpoints when served under ASGI (cinema/asgi.py):
+# however many clients are connected, at most this many of their queries run at once
+ASYNC_DB_WORKERS = 8
+
+
+# Seconds a ticket purchase sent with an Idempotency-Key is remembered and replayed to its retries.
+# Expired keys are deleted by the sweep_idempotency_keys command.
+IDEMPOTENCY_KEY_SECONDS = 24 * 60 * 60
+
+# Seconds a seat hold keeps its seats while the customer pays, before the sweep_seat_holds worker gives
+# them back, and the number of expired holds it releases per transaction
+SEAT_HOLD_SECONDS = 10 * 60
+SEAT_HOLD_SWEEP_BATCH = 500
+
+# Seconds kiosks and shared caches (CDN) may reuse a schedule listing (/showtimes/, /rooms_playing,
+# /movies_playing) before revalidating it with If-None-Match or If-Modified-Since
+LISTING_MAX_AGE = 5
+
+
+# Claim the showtime row with SELECT ... FOR UPDATE SKIP LOCKED before taking seats, so a sale that
+# finds it busy answers 409 straight away instead of waiting. Only used on backends that support it.
+TICKET_RESERVATION_SKIP_LOCKED = False
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -107,7 +211,12 @@ AUTH_PASSWORD_VALIDATORS = [
 
 LANGUAGE_CODE = 'en-us'
 DATETIME_FORMAT = '%Y-%m-%d %H:%M'
-USE_TZ = False
+USE_TZ = True
+# Dates and times sent without a UTC offset are read in this time zone, which is also the one of new rooms
+TIME_ZONE = os.environ.get('CINEMA_TIME_ZONE', 'UTC')
+
+# Showtimes starting before this hour, in their room's time zone, count toward the previous business day
+BUSINESS_DAY_START_HOUR = 5
 
 
 # Static files (CSS, JavaScript, Images)
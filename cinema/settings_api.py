@@ -0,0 +1,38 @@
+"""
+API-only settings for the worker processes serving the JSON API, selected with
+DJANGO_SETTINGS_MODULE=cinema.settings_api.
+
+Everything of cinema.settings except what only the admin and the browsable API need: no admin, auth,
+sessions or messages apps and middleware, no templates or translations, a JSON-only renderer and parser, and
+routes without the API root, format suffixes and login views (ticket_office.api_urls). A fresh worker then imports and
+sets up less before it answers its first request, see the startup benchmark.
+"""
+from cinema.settings import *  # noqa: F401, F403
+
+INSTALLED_APPS = [
+    'ticket_office.apps.TicketOfficeConfig',
+]
+
+MIDDLEWARE = [
+    'ticket_office.middleware.MetricsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+ROOT_URLCONF = 'ticket_office.api_urls'
+
+TEMPLATES = []
+
+REST_FRAMEWORK = dict(
+    REST_FRAMEWORK,  # noqa: F405
+    DEFAULT_RENDERER_CLASSES=['rest_framework.renderers.JSONRenderer'],
+    DEFAULT_PARSER_CLASSES=['rest_framework.parsers.JSONParser'],
+    # no django.contrib.auth: requests are anonymous, request.user is None
+    DEFAULT_AUTHENTICATION_CLASSES=[],
+    DEFAULT_PERMISSION_CLASSES=['rest_framework.permissions.AllowAny'],
+    UNAUTHENTICATED_USER=None,
+)
+
+# messages are in English only, the translation catalogs are not loaded on the first request
+USE_I18N = False
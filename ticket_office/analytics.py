@@ -0,0 +1,184 @@
+"""
+Occupancy analytics: showtimes, seats on sale, seats sold, tickets and fill rate per room, movie or business
+day, and the movies selling the most tickets.
+
+Everything is summed by the database with grouped queries. For the days not rolled up yet that is one query
+over the showtimes of those days, grouped by room, movie or business day, adding up the capacity of their
+rooms and the tickets of each showtime, read from the (showtime, num_seats) index of the Ticket ledger.
+Closed business days are rolled up by
+rollup() (the rollup_occupancy command, run nightly) into the DailyOccupancy table, one row per day, room
+and movie, and read from there instead: a dashboard over years of history then sums a few rows per day
+rather than every ticket.
+"""
+import datetime as dt
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ticket_office import snapshots
+from ticket_office.models import DailyOccupancy, Movie, Room, Showtime, Ticket
+
+# group: (field of the key on Showtime and DailyOccupancy alike, model and field of the name or None). The
+# queries group by the key alone, the names of the keys found are read after in one query
+GROUPS = {
+    'room': ('room_id', Room, 'name'),
+    'movie': ('movie_id', Movie, 'title'),
+    'day': ('business_day', None, None),
+}
+
+FIGURES = ('showtimes', 'capacity', 'seats_sold', 'tickets')
+
+
+def closed_through(now=None):
+    """
+    Last business day over in every time zone, the last day rollup() may roll up
+
+    :param datetime now: defaults to the current time
+    :return: date
+    """
+    cutoff = dt.timedelta(hours=settings.BUSINESS_DAY_START_HOUR)
+    # a business day ends at the cutoff of the next day, latest at UTC-12
+    return (timezone.localtime(now or timezone.now(), timezone.utc) - cutoff + snapshots.EARLIEST_OFFSET).date() \
+        - dt.timedelta(days=1)
+
+
+def rolled_through():
+    """
+    :return: last business day rolled up, None when nothing is
+    """
+    return DailyOccupancy.objects.aggregate(last=Max('business_day'))['last']
+
+
+def in_days(queryset, field, first, last):
+    """
+    :param queryset: queryset to filter
+    :param str field: date field holding the business day
+    :param date first: first business day, None for no limit
+    :param date last: last business day, None for no limit
+    :return: the queryset narrowed to the business days
+    """
+    if first is None and last is None:
+        return queryset
+    # bounded on both ends, so that SQLite's planner walks the business day index rather than the one of the group
+    return queryset.filter(**{field + '__range': (first or dt.date.min, last or dt.date.max)})
+
+
+def per_showtime(aggregate):
+    """
+    :param aggregate: aggregate over the tickets of a showtime
+    :return: subquery of it for the outer showtime, read from the (showtime, num_seats) index
+    """
+    return Subquery(Ticket.objects.filter(showtime=OuterRef('pk')).order_by().values('showtime')
+                    .annotate(figure=aggregate).values('figure'))
+
+
+def with_figures(showtimes):
+    """
+    :param showtimes: values() queryset of showtimes, grouped
+    :return: the queryset annotated with FIGURES
+    """
+    return showtimes.annotate(showtimes=Count('id'), capacity=Sum('room__capacity'),
+                              seats_sold=Coalesce(Sum(per_showtime(Sum('num_seats'))), 0),
+                              tickets=Coalesce(Sum(per_showtime(Count('id'))), 0))
+
+
+def grouped(queryset, group):
+    """
+    :param queryset: Showtime or DailyOccupancy queryset
+    :param str group: key in GROUPS
+    :return: values() queryset grouping the rows by key
+    """
+    return queryset.order_by().values(key=F(GROUPS[group][0]))
+
+
+def live(group, first, last):
+    """
+    Figures summed from the showtimes and the Ticket ledger, in one grouped query
+
+    :return: list of value rows with FIGURES
+    """
+    return list(with_figures(grouped(in_days(Showtime.objects.all(), 'business_day', first, last), group)))
+
+
+def rolled_up(group, first, last):
+    """
+    Figures summed from the DailyOccupancy rollup, in one grouped query
+
+    :return: list of value rows with FIGURES
+    """
+    return list(grouped(in_days(DailyOccupancy.objects.all(), 'business_day', first, last), group)
+                .annotate(**{figure: Sum(figure) for figure in FIGURES}))
+
+
+def occupancy(group, first=None, last=None):
+    """
+    Showtimes, seats on sale, seats sold, tickets and fill rate per room, movie or business day, from the
+    rollup up to the last day rolled up and from the tickets after it
+
+    :param str group: 'room', 'movie' or 'day'
+    :param date first: first business day, None for no limit
+    :param date last: last business day, None for no limit
+    :return: list of dicts, one per group ordered by key
+    """
+    rows = []
+    rolled = rolled_through()
+    if rolled is not None and (first is None or first <= rolled):
+        rows += rolled_up(group, first, rolled if last is None else min(last, rolled))
+        first = rolled + dt.timedelta(days=1)
+    if last is None or first is None or first <= last:
+        rows += live(group, first, last)
+
+    totals = {}
+    for row in rows:
+        total = totals.setdefault(row['key'], dict.fromkeys(FIGURES, 0))
+        for figure in FIGURES:
+            total[figure] += row[figure]
+
+    _, model, name = GROUPS[group]
+    names = dict(model.objects.filter(id__in=totals).values_list('id', name)) if model is not None and totals else {}
+    results = []
+    for key in sorted(totals):
+        total = totals[key]
+        result = {group: key, 'name': names.get(key)} if model is not None else {group: key}
+        result.update(total, fill_rate=round(total['seats_sold'] / total['capacity'], 4) if total['capacity'] else None)
+        results.append(result)
+    return results
+
+
+def top_movies(first=None, last=None, limit=10):
+    """
+    :param date first: first business day, None for no limit
+    :param date last: last business day, None for no limit
+    :param int limit: number of movies
+    :return: the movies that sold the most tickets, then seats, with their figures
+    """
+    movies = occupancy('movie', first, last)
+    return sorted(movies, key=lambda movie: (-movie['tickets'], -movie['seats_sold'], movie['movie']))[:limit]
+
+
+def rollup(first, last):
+    """
+    Recompute the DailyOccupancy rows of business days first to last: one grouped query, then a delete and a
+    bulk insert
+
+    :param date first: first business day
+    :param date last: last business day, closed_through() at most
+    :return: number of rows written
+    """
+    rows = with_figures(Showtime.objects.filter(business_day__range=(first, last)).order_by()
+                        .values('business_day', 'room_id', 'movie_id'))
+    rollups = [DailyOccupancy(**row) for row in rows]
+    with transaction.atomic():
+        DailyOccupancy.objects.filter(business_day__range=(first, last)).delete()
+        DailyOccupancy.objects.bulk_create(rollups, batch_size=500)
+    return len(rollups)
+
+
+def first_day():
+    """
+    :return: business day of the first showtime, None when there is none
+    """
+    return Showtime.objects.aggregate(first=Min('business_day'))['first']
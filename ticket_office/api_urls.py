@@ -0,0 +1,36 @@
+"""
+Routes of the JSON API alone, the ROOT_URLCONF of the API-only settings (cinema/settings_api.py):
+plain routes, without the browsable API root, the format suffixes and the login views ticket_office.urls
+adds on top of them.
+"""
+from django.urls import path
+from rest_framework import routers
+
+from ticket_office import views
+
+
+def register(router):
+    """
+    :param router: DRF router
+    :return: the router, with the viewsets registered
+    """
+    router.register(r'rooms', views.RoomViewSet)
+    router.register(r'movies', views.MovieViewSet)
+    router.register(r'showtimes', views.ShowtimeViewSet)
+    router.register(r'tickets', views.TicketView)
+    router.register(r'holds', views.SeatHoldViewSet)
+    return router
+
+
+endpoints = [
+    path('rooms_playing', views.RoomsPlayingView.as_view(), name='rooms-playing'),
+    path('movies_playing', views.MoviesPlayingView.as_view(), name='movies-playing'),
+    path('analytics/rooms', views.OccupancyView.as_view(group='room'), name='analytics-rooms'),
+    path('analytics/movies', views.OccupancyView.as_view(group='movie'), name='analytics-movies'),
+    path('analytics/days', views.OccupancyView.as_view(group='day'), name='analytics-days'),
+    path('analytics/top_movies', views.TopMoviesView.as_view(), name='analytics-top-movies'),
+    path('cache_stats', views.CacheStatsView.as_view(), name='cache-stats'),
+    path('metrics', views.metrics_view, name='metrics'),
+]
+
+urlpatterns = register(routers.SimpleRouter()).urls + endpoints
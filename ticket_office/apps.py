@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TicketOfficeConfig(AppConfig):
     name = 'ticket_office'
+
+    def ready(self):
+        from ticket_office import signals  # noqa: F401
@@ -0,0 +1,112 @@
+"""
+Async read path for the listing endpoints, used when the project is served by an ASGI server
+(cinema/asgi.py).
+
+Django 3.0 has no async views: under ASGI each request is handed whole to a thread of the event loop's
+default pool, middleware included. AsyncReadHandler answers the listing endpoints itself instead. The DRF
+view still does the work (same serializers, pagination and cache, so the payload is byte for byte the
+one of the WSGI path), but it runs in a small dedicated pool of ASYNC_DB_WORKERS threads sized to what
+the database can take, while reading the request, rendering the JSON and writing it to the client stay
+on the event loop. Many slow clients then wait as cheap coroutines instead of each holding a thread.
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.exception import response_for_exception
+from django.db import close_old_connections, connection
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.security import SecurityMiddleware
+from django.urls import Resolver404, get_resolver, set_urlconf
+from rest_framework.renderers import JSONRenderer
+
+from ticket_office.middleware import QueryRecorder, record
+
+# URL names of the endpoints served on the async path, for GET and HEAD
+ASYNC_VIEWS = {'rooms-playing', 'movies-playing', 'showtime-list', 'showtime-detail'}
+
+
+def run_with_connection(recorder, func, *args, **kwargs):
+    """
+    Run func in a database thread, recording its SQL. The thread's connection is recycled the way
+    Django does around every request, honouring CONN_MAX_AGE
+    """
+    close_old_connections()
+    try:
+        with connection.execute_wrapper(recorder):
+            return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class AsyncReadHandler(ASGIHandler):
+    """
+    ASGI handler serving the ASYNC_VIEWS on the event loop and every other request through the usual
+    middleware stack in a thread.
+
+    The async path skips the middleware, which for these public reads only matters for the metrics and
+    the security headers: both are applied here.
+    """
+    def __init__(self):
+        super().__init__()
+        self.header_middleware = (SecurityMiddleware(), XFrameOptionsMiddleware())
+        self.executor = ThreadPoolExecutor(settings.ASYNC_DB_WORKERS, thread_name_prefix='ticket-office-db')
+
+    async def database(self, recorder, func, *args, **kwargs):
+        """
+        Await func run in the database pool
+
+        :param QueryRecorder recorder: collects the SQL func runs
+        :return: func's return value
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(run_with_connection, recorder, func, *args, **kwargs))
+
+    async def get_response(self, request):
+        set_urlconf(settings.ROOT_URLCONF)
+        match = self.resolve_async(request)
+        if match is None:
+            return await sync_to_async(super().get_response)(request)
+
+        request.resolver_match = match
+        recorder = QueryRecorder(keep_sql=getattr(settings, 'SLOW_REQUEST_SECONDS', None) is not None)
+        began = time.perf_counter()
+        try:
+            response = await self.database(recorder, match.func, request, *match.args, **match.kwargs)
+        except Exception as exc:
+            # DRF handles API errors itself, this is what the middleware stack answers for anything else
+            response = await sync_to_async(response_for_exception)(request, exc)
+
+        rendering = time.perf_counter()
+        if hasattr(response, 'render'):
+            if isinstance(getattr(response, 'accepted_renderer', None), JSONRenderer):
+                response.render()
+            else:
+                # the browsable API renders forms that may query the database
+                await self.database(recorder, response.render)
+        serialization_seconds = time.perf_counter() - rendering
+
+        for middleware in self.header_middleware:
+            response = middleware.process_response(request, response)
+        response._closable_objects.append(request)
+        record(request, match.view_name, response.status_code, time.perf_counter() - began, recorder,
+               serialization_seconds)
+        return response
+
+    def resolve_async(self, request):
+        """
+        :param request:
+        :return: resolver match when the request is for one of the ASYNC_VIEWS, None otherwise
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        try:
+            match = get_resolver(settings.ROOT_URLCONF).resolve(request.path_info)
+        except Resolver404:
+            return None
+        return match if match.view_name in ASYNC_VIEWS else None
@@ -0,0 +1,40 @@
+"""
+SQLite backend starting its transactions with BEGIN IMMEDIATE.
+
+Django opens SQLite transactions with a plain, deferred, BEGIN which takes the write lock at the first
+write only. A sale reading before it writes (the seat map compare-and-swap, the batch's locked reads)
+then has to upgrade its lock, and SQLite fails the upgrade with "database is locked" straight away,
+without waiting for busy_timeout, when another connection wrote meanwhile. Taking the write lock at
+BEGIN makes these transactions queue up for it like every other writer.
+
+The test database also gets its write-ahead log and shared memory files removed along with it: they
+outlive the database file when a test thread's connection was still open, and a stale log would be
+replayed into the next test database.
+"""
+import os
+
+from django.db.backends.sqlite3 import base, creation
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def remove_journal(self, test_database_name):
+        if test_database_name and not self.is_in_memory_db(test_database_name):
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(test_database_name + suffix):
+                    os.remove(test_database_name + suffix)
+
+    def _create_test_db(self, verbosity, autoclobber, keepdb=False):
+        if not keepdb:
+            self.remove_journal(self._get_test_db_name())
+        return super()._create_test_db(verbosity, autoclobber, keepdb)
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        super()._destroy_test_db(test_database_name, verbosity)
+        self.remove_journal(test_database_name)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,92 @@
+"""
+Performance scenarios for the ticket_office API, run with ``python manage.py benchmark <scenario>``.
+
+Each scenario module exposes ``run(size, **options)``, which seeds what it needs into the (throwaway)
+test database and returns a flat dict of measurements. Measurements can be saved as a JSON baseline and
+later runs compared against it.
+"""
+import statistics
+import time
+from importlib import import_module
+
+SCENARIOS = {
+    'analytics': 'ticket_office.benchmarks.analytics',
+    'api': 'ticket_office.benchmarks.api',
+    'asgi': 'ticket_office.benchmarks.asgi',
+    'bulk_showtimes': 'ticket_office.benchmarks.bulk_showtimes',
+    'db_profiles': 'ticket_office.benchmarks.db_profiles',
+    'export': 'ticket_office.benchmarks.export',
+    'read_serializers': 'ticket_office.benchmarks.read_serializers',
+    'search': 'ticket_office.benchmarks.search',
+    'seat_counter': 'ticket_office.benchmarks.seat_counter',
+    'startup': 'ticket_office.benchmarks.startup',
+    'ticket_batch': 'ticket_office.benchmarks.ticket_batch',
+}
+
+# suffixes telling which way a measurement should go, anything else is informative only
+LOWER_IS_BETTER = ('_ms', '_seconds', '_queries', '_mb')
+HIGHER_IS_BETTER = ('_per_second', '_rps', 'speedup')
+# any rise of these is a regression, from a baseline of 0 too
+NO_INCREASE = ('_errors', '.errors')
+
+
+def run_scenario(name, size=None, **options):
+    """
+    Run a scenario by name
+
+    :param str name: key in SCENARIOS
+    :param int size: scenario specific workload size, None for the scenario's default
+    :param options: scenario specific options
+    :return: dict of measurements
+    """
+    module = import_module(SCENARIOS[name])
+    return module.run(size or module.DEFAULT_SIZE, **options)
+
+
+def timed(func, *args, **kwargs):
+    """
+    Call func and measure it
+
+    :return: tuple of (seconds elapsed, func's return value)
+    """
+    began = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - began, result
+
+
+def percentiles(seconds, prefix=''):
+    """
+    :param list seconds: latency samples
+    :param str prefix: prepended to the measurement names
+    :return: dict with the p50, p95 and p99 latencies in milliseconds
+    """
+    cuts = statistics.quantiles(seconds, n=100, method='inclusive') if len(seconds) > 1 else seconds * 99
+    return {'{}p{}_ms'.format(prefix, p): round(cuts[p - 1] * 1000, 2) for p in (50, 95, 99)}
+
+
+def compare(results, baseline, threshold):
+    """
+    Find the measurements that got worse than the baseline by more than threshold, and the error counts
+    that rose at all
+
+    :param dict results: measurements of this run
+    :param dict baseline: measurements of the reference run
+    :param float threshold: tolerated relative change, 0.2 for 20%
+    :return: list of messages, one per regression
+    """
+    regressions = []
+    for name, reference in sorted(baseline.items()):
+        value = results.get(name)
+        if not isinstance(value, (int, float)) or not isinstance(reference, (int, float)):
+            continue
+        if name.endswith(NO_INCREASE):
+            if value > reference:
+                regressions.append('{}: {} against {} in the baseline'.format(name, value, reference))
+            continue
+        if not reference:
+            continue
+        change = (value - reference) / reference
+        if (name.endswith(LOWER_IS_BETTER) and change > threshold) or \
+                (name.endswith(HIGHER_IS_BETTER) and -change > threshold):
+            regressions.append('{}: {} against {} in the baseline ({:+.0%})'.format(name, value, reference, change))
+    return regressions
@@ -0,0 +1,65 @@
+"""
+Occupancy analytics over years of history: the figures per room, movie and business day summed from the
+tickets with grouped queries (live), then from the nightly DailyOccupancy rollup once every closed day is
+rolled up (rolled_up). Both are checked to give the same figures.
+"""
+import datetime as dt
+import statistics
+
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ticket_office import analytics
+from ticket_office.benchmarks import timed
+from ticket_office.benchmarks.seed import seed
+from ticket_office.middleware import QueryRecorder
+
+DEFAULT_SIZE = 50000
+ROOMS = 10
+MOVIES = 100
+TICKETS_PER_SHOWTIME = 10
+# about nine back to back showtimes a day per room, the default size is a year and a half of history
+SHOWTIMES_PER_DAY = ROOMS * 9
+SAMPLES = 5
+
+PATHS = {'room': '/analytics/rooms', 'movie': '/analytics/movies', 'day': '/analytics/days'}
+
+
+def measure(client, path):
+    """
+    :return: tuple of (median milliseconds, SQL queries per request, last response data)
+    """
+    samples = []
+    for _ in range(SAMPLES):
+        queries = QueryRecorder(keep_sql=False)
+        with connection.execute_wrapper(queries):
+            seconds, response = timed(client.get, path)
+        assert response.status_code == 200, response.data
+        samples.append(seconds)
+    return round(statistics.median(samples) * 1000, 1), queries.count, response.data
+
+
+def run(size, **options):
+    start = (timezone.now() - dt.timedelta(days=size // SHOWTIMES_PER_DAY + 1)).replace(hour=10, minute=0, second=0,
+                                                                                        microsecond=0)
+    seed(rooms=ROOMS, movies=MOVIES, showtimes=size, tickets=size * TICKETS_PER_SHOWTIME, start=start)
+    client = APIClient()
+
+    results = {'showtimes': size, 'tickets': size * TICKETS_PER_SHOWTIME}
+    live = {}
+    for group, path in PATHS.items():
+        results['{}.live_ms'.format(group)], results['{}.live_queries'.format(group)], live[group] = \
+            measure(client, path)
+
+    rollup_seconds, rows = timed(analytics.rollup, analytics.first_day(), analytics.closed_through())
+    results['rollup_seconds'] = round(rollup_seconds, 3)
+    results['rollup_rows'] = rows
+
+    for group, path in PATHS.items():
+        milliseconds, queries, data = measure(client, path)
+        assert data == live[group], '{} figures differ'.format(group)
+        results['{}.rolled_up_ms'.format(group)], results['{}.rolled_up_queries'.format(group)] = \
+            milliseconds, queries
+        results['{}.speedup'.format(group)] = round(results['{}.live_ms'.format(group)] / milliseconds, 1)
+    return results
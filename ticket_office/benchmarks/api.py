@@ -0,0 +1,117 @@
+"""
+Latency, throughput and query counts of the main endpoints over a realistic catalogue, measured twice:
+in process through the Django test client, and over HTTP with concurrent clients against a live server
+(started here on the test database, or an already running one given with --url).
+"""
+import datetime as dt
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from django.db import connection
+from django.test.testcases import LiveServerThread
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from ticket_office.benchmarks import percentiles
+from ticket_office.benchmarks.seed import seed
+from ticket_office.middleware import QueryRecorder
+from ticket_office.models import Showtime
+
+DEFAULT_SIZE = 200000
+
+
+def endpoints(showtime_ids, generator):
+    """
+    :return: list of (name, method, path, body factory) for every endpoint under test
+    """
+    week = dt.date.today() + dt.timedelta(days=1)
+    window = 'start={}&end={}'.format(week, week + dt.timedelta(days=7))
+    return [
+        ('showtimes', 'GET', '/showtimes/', None),
+        ('tickets', 'GET', '/tickets/', None),
+        ('rooms_playing', 'GET', '/rooms_playing?' + window, None),
+        ('movies_playing', 'GET', '/movies_playing?' + window, None),
+        ('buy_ticket', 'POST', '/tickets/', lambda: {'showtime': generator.choice(showtime_ids), 'num_seats': 1}),
+    ]
+
+
+def measure_client(endpoint, requests):
+    name, method, path, body = endpoint
+    client = APIClient()
+    latencies, queries = [], 0
+    for _ in range(requests):
+        recorder = QueryRecorder(keep_sql=False)
+        began = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            if method == 'GET':
+                response = client.get(path)
+            else:
+                response = client.post(path, body(), format='json')
+        latencies.append(time.perf_counter() - began)
+        queries += recorder.count
+        assert response.status_code < 400, (path, response.status_code)
+
+    results = percentiles(latencies, '{}.client_'.format(name))
+    results['{}.client_rps'.format(name)] = round(len(latencies) / sum(latencies), 1)
+    results['{}.client_queries'.format(name)] = round(queries / requests, 1)
+    return results
+
+
+def measure_http(endpoint, base_url, requests, concurrency):
+    name, method, path, body = endpoint
+
+    def call(_):
+        data = json.dumps(body()).encode() if body else None
+        request = Request(base_url + path, data=data, method=method, headers={'Content-Type': 'application/json'})
+        began = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                response.read()
+            failed = False
+        except (URLError, ConnectionError):
+            # error statuses (HTTPError), and refused or dropped connections
+            failed = True
+        return time.perf_counter() - began, failed
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - began
+
+    results = percentiles([latency for latency, _ in outcomes], '{}.http_'.format(name))
+    results['{}.http_rps'.format(name)] = round(requests / elapsed, 1)
+    results['{}.http_errors'.format(name)] = sum(failed for _, failed in outcomes)
+    return results
+
+
+def run(size, url=None, requests=200, concurrency=16, **options):
+    generator = random.Random(0)
+    seed(rooms=50, movies=min(2000, max(1, size // 100)), showtimes=size, tickets=size // 10)
+    showtime_ids = list(Showtime.objects.values_list('id', flat=True))
+    tested = endpoints(showtime_ids, generator)
+
+    results = {'showtimes': size, 'requests': requests, 'concurrency': concurrency}
+    for endpoint in tested:
+        results.update(measure_client(endpoint, requests))
+
+    server = None
+    if url is None:
+        server = LiveServerThread('localhost', lambda handler: handler)
+        server.daemon = True
+        server.start()
+        server.is_ready.wait()
+        if server.error:
+            raise server.error
+        url = 'http://localhost:{}'.format(server.port)
+    try:
+        with override_settings(ALLOWED_HOSTS=['localhost', '127.0.0.1', 'testserver']):
+            for endpoint in tested:
+                results.update(measure_http(endpoint, url.rstrip('/'), requests, concurrency))
+    finally:
+        if server is not None:
+            server.terminate()
+    return results
@@ -0,0 +1,132 @@
+"""
+The listing endpoints under many concurrent slow clients, served three ways with the same thread budget:
+
+- wsgi: a threaded WSGI worker, every request holds one of `workers` threads until its client has read
+  the whole response
+- asgi_sync: Django's stock ASGI handler, every view runs in a thread of the event loop's pool
+- asgi: AsyncReadHandler, only the view runs in one of ASYNC_DB_WORKERS = `workers` threads and the
+  event loop writes to the clients
+
+Clients are simulated in process: each one takes CLIENT_SECONDS to read a response, the way a slow
+network or a mobile client would.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from ticket_office.asgi import AsyncReadHandler
+from ticket_office.benchmarks import percentiles
+from ticket_office.benchmarks.seed import seed
+from ticket_office.models import Showtime
+
+DEFAULT_SIZE = 20000
+CLIENT_SECONDS = 0.05
+
+
+def endpoints(showtime_id):
+    return [
+        ('showtimes', '/showtimes/', ''),
+        ('showtime', '/showtimes/{}/'.format(showtime_id), ''),
+        ('rooms_playing', '/rooms_playing', ''),
+        ('movies_playing', '/movies_playing', ''),
+    ]
+
+
+def summarize(name, mode, latencies, elapsed, failures):
+    results = percentiles(latencies, '{}.{}_'.format(name, mode))
+    results['{}.{}_rps'.format(name, mode)] = round(len(latencies) / elapsed, 1)
+    results['{}.{}_errors'.format(name, mode)] = failures
+    return results
+
+
+def measure_wsgi(endpoint, requests, concurrency, workers):
+    name, path, query = endpoint
+    handler = WSGIHandler()
+    environ = RequestFactory().get(path, QUERY_STRING=query).environ
+    worker_threads = threading.BoundedSemaphore(workers)
+    latencies, failures = [], []
+
+    def client(count):
+        for _ in range(count):
+            began = time.perf_counter()
+            with worker_threads:
+                statuses = []
+                response = handler(dict(environ), lambda status, headers: statuses.append(status))
+                b''.join(response)
+                time.sleep(CLIENT_SECONDS)
+                response.close()
+            latencies.append(time.perf_counter() - began)
+            failures.append(not statuses[0].startswith('200'))
+
+    began = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(share,)) for share in shares(requests, concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return summarize(name, 'wsgi', latencies, time.perf_counter() - began, sum(failures))
+
+
+def measure_asgi(endpoint, requests, concurrency, workers, handler, mode):
+    name, path, query = endpoint
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(),
+             'headers': [(b'host', b'testserver')]}
+    latencies, failures = [], []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def client(count):
+        for _ in range(count):
+            statuses = []
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                elif not message.get('more_body'):
+                    await asyncio.sleep(CLIENT_SECONDS)
+
+            began = time.perf_counter()
+            await handler(dict(scope), receive, send)
+            latencies.append(time.perf_counter() - began)
+            failures.append(statuses[0] != 200)
+
+    async def load():
+        # the stock handler runs views in the loop's default pool, give it the same thread budget
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(workers))
+        await asyncio.gather(*(client(share) for share in shares(requests, concurrency)))
+
+    began = time.perf_counter()
+    asyncio.run(load())
+    return summarize(name, mode, latencies, time.perf_counter() - began, sum(failures))
+
+
+def shares(requests, concurrency):
+    """
+    :return: number of requests each client sends, requests spread over concurrency clients
+    """
+    return [requests // concurrency + (index < requests % concurrency) for index in range(concurrency)]
+
+
+def run(size, requests=2000, concurrency=200, workers=8, **options):
+    seed(rooms=50, movies=min(2000, max(1, size // 100)), showtimes=size, tickets=size // 10)
+    tested = endpoints(Showtime.objects.values_list('id', flat=True).first())
+
+    results = {'showtimes': size, 'requests': requests, 'concurrency': concurrency, 'workers': workers,
+               'client_ms': CLIENT_SECONDS * 1000}
+    with override_settings(ASYNC_DB_WORKERS=workers):
+        async_handler = AsyncReadHandler()
+    for endpoint in tested:
+        results.update(measure_wsgi(endpoint, requests, concurrency, workers))
+        results.update(measure_asgi(endpoint, requests, concurrency, workers, ASGIHandler(), 'asgi_sync'))
+        results.update(measure_asgi(endpoint, requests, concurrency, workers, async_handler, 'asgi'))
+        results['{}.asgi_speedup'.format(endpoint[0])] = round(
+            results['{}.asgi_rps'.format(endpoint[0])] / results['{}.wsgi_rps'.format(endpoint[0])], 2)
+    async_handler.executor.shutdown()
+    return results
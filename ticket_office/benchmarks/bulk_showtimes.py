@@ -0,0 +1,42 @@
+"""
+Scheduling N showtimes with N single POSTs versus one bulk POST
+"""
+import datetime as dt
+
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ticket_office.benchmarks import timed
+from ticket_office.models import Movie, Room, Showtime
+
+DEFAULT_SIZE = 1000
+ROOMS = 10
+
+
+def schedule(rooms, movie, start, size):
+    return [{'room': rooms[i % len(rooms)].id, 'movie': movie.id,
+             'start_date': str(start + dt.timedelta(hours=2 * (i // len(rooms))))} for i in range(size)]
+
+
+def run(size, **options):
+    client = APIClient()
+    rooms = [Room.objects.create(name='room {}'.format(i), capacity=100) for i in range(ROOMS)]
+    movie = Movie.objects.create(title='benchmark movie', duration=90)
+    start = (timezone.now() + dt.timedelta(days=1)).replace(minute=0, second=0, microsecond=0)
+
+    single, _ = timed(lambda: [client.post('/showtimes/', item, format='json')
+                               for item in schedule(rooms, movie, start, size)])
+    assert Showtime.objects.count() == size
+    Showtime.objects.all().delete()
+
+    bulk, response = timed(client.post, '/showtimes/bulk/', schedule(rooms, movie, start, size), format='json')
+    assert response.status_code == 201, response.data
+
+    return {
+        'showtimes': size,
+        'single_posts_seconds': round(single, 3),
+        'single_posts_per_second': round(size / single),
+        'bulk_post_seconds': round(bulk, 3),
+        'bulk_showtimes_per_second': round(size / bulk),
+        'speedup': round(single / bulk, 1),
+    }
@@ -0,0 +1,118 @@
+"""
+Concurrent ticket sales under each database profile of the current engine, served by Django's WSGI
+handler so connections are opened and closed per request the way a real server does.
+
+SQLite profiles:
+- rollback: the old pragmas, rollback journal with a full fsync per commit, and a connection per request
+- wal: SQLITE_PRAGMAS (write-ahead log, busy_timeout, synchronous=normal), a connection per request
+- wal_persistent: SQLITE_PRAGMAS and connections reused for CONN_MAX_AGE
+
+Postgres profiles: per_request and persistent connections. Run with CINEMA_DB_ENGINE=postgres.
+
+`size` purchases of one seat are spread over SHOWTIMES showtimes, half of them in rooms with a seat map,
+by `concurrency` threads; every showtime has enough seats for all of them.
+"""
+import datetime as dt
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from ticket_office.benchmarks import percentiles
+from ticket_office.models import Movie, Room, SeatLayout, Showtime, Ticket
+
+DEFAULT_SIZE = 1000
+SHOWTIMES = 10
+ROLLBACK_PRAGMAS = {'journal_mode': 'delete', 'busy_timeout': 20000, 'synchronous': 'full'}
+
+
+def profiles():
+    """
+    :return: dict of profile name to (SQLITE_PRAGMAS, CONN_MAX_AGE)
+    """
+    if connection.vendor == 'sqlite':
+        return {
+            'rollback': (ROLLBACK_PRAGMAS, 0),
+            'wal': (settings.SQLITE_PRAGMAS, 0),
+            'wal_persistent': (settings.SQLITE_PRAGMAS, 60),
+        }
+    return {'per_request': ({}, 0), 'persistent': ({}, 60)}
+
+
+def seed(capacity):
+    movie = Movie.objects.create(title='benchmark movie', duration=90)
+    start = timezone.now() + dt.timedelta(days=1)
+    showtime_ids = []
+    for i in range(SHOWTIMES):
+        room = Room.objects.create(name='room {}'.format(i), capacity=capacity)
+        if i % 2:
+            SeatLayout.objects.create(room=room, rows=capacity // 10, seats_per_row=10)
+        show_start = start + dt.timedelta(hours=2 * i)
+        showtime_ids.append(Showtime.objects.create(room=room, movie=movie, available=capacity,
+                                                    start_date=show_start,
+                                                    end_date=show_start + dt.timedelta(minutes=90)).id)
+    return showtime_ids
+
+
+def measure(name, showtime_ids, purchases, concurrency):
+    handler = WSGIHandler()
+    factory = RequestFactory()
+    remaining = iter(range(purchases))
+    lock = threading.Lock()
+    latencies, statuses = [], []
+
+    def buy():
+        try:
+            while True:
+                with lock:
+                    index = next(remaining, None)
+                if index is None:
+                    return
+                body = json.dumps({'showtime': showtime_ids[index % len(showtime_ids)], 'num_seats': 1})
+                environ = factory.post('/tickets/', body, content_type='application/json').environ
+                began = time.perf_counter()
+                response = handler(environ, lambda status, headers: statuses.append(int(status[:3])))
+                b''.join(response)
+                response.close()
+                latencies.append(time.perf_counter() - began)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=buy) for _ in range(concurrency)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    results = percentiles(latencies, '{}_'.format(name))
+    results['{}_sales_per_second'.format(name)] = round(statuses.count(201) / elapsed)
+    results['{}_errors'.format(name)] = len(statuses) - statuses.count(201)
+    return results
+
+
+def run(size, concurrency=16, **options):
+    capacity = -(-size // 10) * 10
+    showtime_ids = seed(capacity)
+    database = connections.databases['default']
+    conn_max_age = database['CONN_MAX_AGE']
+    results = {'purchases': size, 'concurrency': concurrency, 'engine': connection.vendor}
+    try:
+        for name, (pragmas, max_age) in profiles().items():
+            database['CONN_MAX_AGE'] = max_age
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                connection.close()  # the next connection runs the profile's pragmas
+                Ticket.objects.all().delete()
+                Showtime.objects.update(available=capacity, occupancy=None)
+                results.update(measure(name, showtime_ids, size, concurrency))
+    finally:
+        database['CONN_MAX_AGE'] = conn_max_age
+        connection.close()
+    return results
@@ -0,0 +1,67 @@
+"""
+Streaming ticket export versus serializing the whole table with TicketSerializer: time to first byte,
+total time and peak Python memory
+"""
+import datetime as dt
+import time
+import tracemalloc
+
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ticket_office.benchmarks import timed
+from ticket_office.models import Movie, Room, Showtime, Ticket
+from ticket_office.serializers import TicketSerializer
+
+DEFAULT_SIZE = 10000
+SHOWTIMES = 100
+
+
+def seed(size):
+    room = Room.objects.create(name='benchmark room', capacity=size)
+    movie = Movie.objects.create(title='benchmark movie', duration=90)
+    start = timezone.now() + dt.timedelta(days=1)
+    Showtime.objects.bulk_create([Showtime(room=room, movie=movie, available=size,
+                                           start_date=start + dt.timedelta(hours=2 * i),
+                                           end_date=start + dt.timedelta(hours=2 * i, minutes=90))
+                                  for i in range(SHOWTIMES)])
+    showtimes = list(Showtime.objects.values_list('id', flat=True))
+    Ticket.objects.bulk_create([Ticket(showtime_id=showtimes[i % SHOWTIMES], num_seats=1) for i in range(size)])
+
+
+def measure(func):
+    tracemalloc.start()
+    try:
+        seconds, result = timed(func)
+        return seconds, tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def stream_export(client):
+    began = time.perf_counter()
+    response = client.get('/tickets/export/')
+    content = iter(response.streaming_content)
+    first = next(content)
+    first_byte = time.perf_counter() - began
+    size = len(first) + sum(len(chunk) for chunk in content)
+    return first_byte, size
+
+
+def run(size, **options):
+    seed(size)
+    client = APIClient()
+
+    stream_seconds, stream_peak, (first_byte, stream_bytes) = measure(lambda: stream_export(client))
+    serializer_seconds, serializer_peak, data = measure(lambda: TicketSerializer(Ticket.objects.all(), many=True).data)
+    assert len(data) == size
+
+    return {
+        'tickets': size,
+        'export_first_byte_ms': round(first_byte * 1000, 1),
+        'export_seconds': round(stream_seconds, 3),
+        'export_peak_mb': round(stream_peak / 2 ** 20, 1),
+        'export_mb': round(stream_bytes / 2 ** 20, 1),
+        'serializer_seconds': round(serializer_seconds, 3),
+        'serializer_peak_mb': round(serializer_peak / 2 ** 20, 1),
+    }
@@ -0,0 +1,47 @@
+"""
+Rows serialized per second by the list endpoints' serializers: ModelSerializer over model instances, as
+the lists used to (model), the same with the related rows joined by select_related (joined, which leaves
+only the serializer's own cost), and ValuesSerializer over values() rows (values). All three are checked
+to render to the same JSON bytes.
+"""
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+
+from ticket_office.benchmarks import timed
+from ticket_office.benchmarks.seed import seed
+from ticket_office.middleware import QueryRecorder
+from ticket_office.models import Showtime, Ticket
+from ticket_office.serializers import ShowtimeSerializer, ShowtimeValuesSerializer, TicketSerializer, \
+    TicketValuesSerializer
+
+DEFAULT_SIZE = 5000
+
+
+def measure(name, queryset, related, model_serializer, values_serializer):
+    variants = {
+        'model': lambda: model_serializer(list(queryset), many=True).data,
+        'joined': lambda: model_serializer(list(queryset.select_related(*related)), many=True).data,
+        'values': lambda: values_serializer.to_representation(list(values_serializer.values(queryset))),
+    }
+    results, payloads, seconds = {}, set(), {}
+    for variant, serialize in variants.items():
+        queries = QueryRecorder(keep_sql=False)
+        with connection.execute_wrapper(queries):
+            seconds[variant], data = timed(serialize)
+        payloads.add(JSONRenderer().render(data))
+        results['{}.{}_rows_per_second'.format(name, variant)] = round(len(data) / seconds[variant])
+        results['{}.{}_queries'.format(name, variant)] = queries.count
+    assert len(payloads) == 1, '{} payloads differ'.format(name)
+    results['{}.speedup'.format(name)] = round(seconds['model'] / seconds['values'], 1)
+    results['{}.joined_speedup'.format(name)] = round(seconds['joined'] / seconds['values'], 1)
+    return results
+
+
+def run(size, **options):
+    seed(rooms=50, movies=max(1, size // 20), showtimes=size, tickets=size)
+    results = {'rows': size}
+    results.update(measure('showtimes', Showtime.objects.order_by('start_date', 'id'), ('room', 'movie'),
+                           ShowtimeSerializer, ShowtimeValuesSerializer))
+    results.update(measure('tickets', Ticket.objects.order_by('id'), ('showtime__room', 'showtime__movie'),
+                           TicketSerializer, TicketValuesSerializer))
+    return results
@@ -0,0 +1,76 @@
+"""
+Movie title search over size titles: latency of the title index (index) against scanning the titles with
+icontains (scan), both through search.search(), and of the /movies/search/ endpoint answered from the
+index (endpoint). Queries are whole words of a random title (full_text) and, as typed, its first word and
+the beginning of the next one (prefix).
+"""
+import random
+from unittest import mock
+
+from rest_framework.test import APIClient
+
+from ticket_office import search
+from ticket_office.benchmarks import percentiles, timed
+from ticket_office.models import Movie
+
+DEFAULT_SIZE = 100000
+QUERIES = 200
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ra', 'to', 'su', 'vi', 'den', 'mar', 'tor', 'gal', 'sin', 'bel', 'dor',
+             'ex', 'an', 'qu', 'zo', 'ri']
+COMMON_WORDS = ['the', 'of', 'a', 'and', 'in', 'night', 'last', 'return']
+
+
+def titles(generator, size):
+    vocabulary = sorted({''.join(generator.choice(SYLLABLES) for _ in range(generator.randint(2, 4)))
+                         for _ in range(20000)})
+    for _ in range(size):
+        words = [generator.choice(vocabulary) for _ in range(generator.randint(1, 3))]
+        if generator.random() < 0.4:
+            words.insert(generator.randrange(len(words) + 1), generator.choice(COMMON_WORDS))
+        yield ' '.join(words).title()
+
+
+def queries(generator, sample):
+    """
+    :return: dict of mode to (query, mode) pairs
+    """
+    full_text, prefix = [], []
+    for title in sample:
+        words = [word for word in search.terms(title) if word not in COMMON_WORDS] or search.terms(title)
+        full_text.append(' '.join(words[:2]))
+        typed = words[0] if len(words) == 1 else words[0] + ' ' + words[1]
+        prefix.append(typed[:max(3, len(typed) - generator.randint(0, 3))])
+    return {search.FULL_TEXT: full_text, search.PREFIX: prefix}
+
+
+def latencies(func, items):
+    samples, matches = [], 0
+    for item in items:
+        seconds, found = timed(func, item)
+        samples.append(seconds)
+        matches += bool(found)
+    return samples, matches
+
+
+def run(size, **options):
+    generator = random.Random(0)
+    Movie.objects.bulk_create([Movie(title=title, duration=120) for title in titles(generator, size)])
+    index_seconds, _ = timed(search.rebuild)
+    sample = generator.sample(list(Movie.objects.values_list('title', flat=True)), QUERIES)
+    client = APIClient()
+
+    results = {'titles': size, 'backend': search.backend(), 'index_build_seconds': round(index_seconds, 3)}
+    for mode, items in queries(generator, sample).items():
+        samples, matches = latencies(lambda query: search.search(query, mode), items)
+        results.update(percentiles(samples, '{}.index_'.format(mode)))
+        results['{}.matched'.format(mode)] = matches
+
+        samples, _ = latencies(lambda query: client.get('/movies/search/', {'q': query, 'mode': mode}).data, items)
+        results.update(percentiles(samples, '{}.endpoint_'.format(mode)))
+
+        with mock.patch('ticket_office.search.backend', return_value=None):
+            scan_samples, _ = latencies(lambda query: search.search(query, mode), items[:20])
+        results.update(percentiles(scan_samples, '{}.scan_'.format(mode)))
+        results['{}.speedup'.format(mode)] = round(
+            results['{}.scan_p50_ms'.format(mode)] / results['{}.index_p50_ms'.format(mode)], 1)
+    return results
@@ -0,0 +1,76 @@
+"""
+Parallel purchases of one hot showtime, sold from its row (db) and from a write-behind seat counter
+(counter). `size` purchases of one seat are fired by `concurrency` threads at a room of half that
+capacity, so half of them find the showtime sold out.
+"""
+import datetime as dt
+import threading
+import time
+
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ticket_office import seat_counters
+from ticket_office.benchmarks import percentiles
+from ticket_office.models import Movie, Room, Showtime, Ticket
+
+DEFAULT_SIZE = 2000
+
+
+def measure(mode, showtime, purchases, concurrency):
+    remaining = iter(range(purchases))
+    lock = threading.Lock()
+    latencies, statuses = [], []
+
+    def buy():
+        client = APIClient()
+        try:
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                began = time.perf_counter()
+                response = client.post('/tickets/', {'showtime': showtime.id, 'num_seats': 1}, format='json')
+                latencies.append(time.perf_counter() - began)
+                statuses.append(response.status_code)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=buy) for _ in range(concurrency)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    if mode == 'counter':
+        seat_counters.flush()
+    sold = Ticket.objects.filter(showtime=showtime).count()
+    assert sold == showtime.room.capacity, '{} oversold: {} tickets'.format(mode, sold)
+    assert Showtime.objects.get(id=showtime.id).available == 0
+
+    results = percentiles(latencies, '{}_'.format(mode))
+    results['{}_purchases_per_second'.format(mode)] = round(purchases / elapsed)
+    results['{}_errors'.format(mode)] = sum(code not in (201, 400) for code in statuses)
+    return results
+
+
+def run(size, concurrency=16, **options):
+    movie = Movie.objects.create(title='benchmark movie', duration=90)
+    start = timezone.now() + dt.timedelta(days=1)
+    showtimes = {}
+    for mode in ('db', 'counter'):
+        room = Room.objects.create(name='{} room'.format(mode), capacity=size // 2)
+        showtimes[mode] = Showtime.objects.create(room=room, movie=movie, available=room.capacity,
+                                                  start_date=start, end_date=start + dt.timedelta(minutes=90))
+    # the purchases are threads of this process
+    seat_counters.enable([showtimes['counter'].id], single_process=True)
+
+    results = {'purchases': size, 'seats': size // 2, 'concurrency': concurrency}
+    for mode, showtime in showtimes.items():
+        results.update(measure(mode, showtime, size, concurrency))
+    results['speedup'] = round(results['counter_purchases_per_second'] / results['db_purchases_per_second'], 2)
+    seat_counters.disable([showtimes['counter'].id])
+    return results
@@ -0,0 +1,67 @@
+"""
+Realistic catalogue for benchmarks and load tests, written with bulk_create
+"""
+import datetime as dt
+import random
+from collections import Counter
+
+from django.utils import timezone
+
+from ticket_office import search, snapshots
+from ticket_office.caching import bump_generation
+from ticket_office.models import Movie, Room, Showtime, Ticket
+
+BATCH_SIZE = 5000
+BREAK = dt.timedelta(minutes=30)
+
+
+def seed(rooms=50, movies=2000, showtimes=200000, tickets=20000, start=None, random_seed=0):
+    """
+    Create rooms, movies, back to back showtimes spread over the rooms and tickets for random showtimes.
+    bulk_create sends no signals, so the playing snapshots and the title search are rebuilt and the cache
+    invalidated after.
+
+    :param datetime start: first showtime, tomorrow morning when None
+    :param int random_seed: the same seed always produces the same catalogue
+    :return: dict with the number of rows created per model
+    """
+    generator = random.Random(random_seed)
+    start = start or (timezone.now() + dt.timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+
+    Room.objects.bulk_create([Room(name='Room {}'.format(i + 1), capacity=generator.choice((60, 120, 200, 350)))
+                              for i in range(rooms)])
+    Movie.objects.bulk_create([Movie(title='Movie {}'.format(i + 1), duration=generator.randint(80, 180))
+                               for i in range(movies)])
+    room_rows = sorted(Room.objects.order_by('-id').values_list('id', 'capacity')[:rooms])
+    movie_rows = sorted(Movie.objects.order_by('-id').values_list('id', 'duration')[:movies])
+
+    # tickets are planned first so every showtime is created with its availability already discounted
+    sales = [(generator.randrange(showtimes), generator.randint(1, 4)) for _ in range(tickets if showtimes else 0)]
+    sold = Counter()
+    for index, seats in sales:
+        sold[index] += seats
+
+    clock = {room_id: start for room_id, _ in room_rows}
+    batch = []
+    for index in range(showtimes):
+        room_id, capacity = room_rows[index % rooms]
+        movie_id, duration = generator.choice(movie_rows)
+        show_start = clock[room_id]
+        show_end = show_start + dt.timedelta(minutes=duration)
+        clock[room_id] = show_end + BREAK
+        batch.append(Showtime(room_id=room_id, movie_id=movie_id, available=max(capacity - sold[index], 0),
+                              start_date=show_start, end_date=show_end))
+        if len(batch) == BATCH_SIZE:
+            Showtime.objects.bulk_create(batch)
+            batch = []
+    Showtime.objects.bulk_create(batch)
+
+    showtime_ids = sorted(Showtime.objects.order_by('-id').values_list('id', flat=True)[:showtimes])
+    for offset in range(0, len(sales), BATCH_SIZE):
+        Ticket.objects.bulk_create([Ticket(showtime_id=showtime_ids[index], num_seats=seats)
+                                    for index, seats in sales[offset:offset + BATCH_SIZE]])
+
+    snapshots.rebuild()
+    search.rebuild()
+    bump_generation(Room, Movie, Showtime, Ticket)
+    return {'rooms': rooms, 'movies': movies, 'showtimes': showtimes, 'tickets': tickets}
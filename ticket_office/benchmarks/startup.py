@@ -0,0 +1,100 @@
+"""
+Cold start of a WSGI worker, the way the autoscaler starts them: for each settings profile, size fresh
+Python processes each load cinema.wsgi and answer one /showtimes/ request from the benchmark database.
+
+- setup_ms: importing Django and the project and setting it up, until the WSGI application exists
+- first_request_ms: the first request, which also imports the URLconf, the views and DRF
+- ready_ms: both, the time from process start to the first response
+- import_ms and modules: time spent importing and modules imported until the first response, read from one
+  more process run with python -X importtime
+
+Both settings profiles also run with SETUPTOOLS_USE_DISTUTILS=stdlib in the environment (the *_stdlib_distutils
+results): on Python 3.10+ with setuptools 60+, Django's version module otherwise imports distutils through
+setuptools' shim, which drags in pkg_resources. The speedup of the API-only settings is measured against the
+full ones under the same environment, so it doesn't count the variable's gain.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.db import connection
+
+from ticket_office.benchmarks.seed import seed
+
+DEFAULT_SIZE = 10
+
+SETTINGS = [('full', 'cinema.settings'), ('api', 'cinema.settings_api')]
+ENVIRONMENTS = [('', {}), ('_stdlib_distutils', {'SETUPTOOLS_USE_DISTUTILS': 'stdlib'})]
+PROFILES = [(name + suffix, settings_module, environment)
+            for suffix, environment in ENVIRONMENTS for name, settings_module in SETTINGS]
+
+# run in the worker process, no import before the clock starts but the stdlib ones it needs
+WORKER = """
+import io, json, sys, time
+began = time.perf_counter()
+from django.conf import settings
+settings.DATABASES['default']['NAME'] = sys.argv[1]
+settings.ALLOWED_HOSTS = ['localhost']
+from cinema.wsgi import application
+ready = time.perf_counter()
+environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/showtimes/', 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+           'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'HTTP_ACCEPT': 'application/json',
+           'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr}
+statuses = []
+response = application(environ, lambda status, headers: statuses.append(status))
+b''.join(response)
+response.close()
+answered = time.perf_counter()
+print(json.dumps({'setup': ready - began, 'first_request': answered - ready, 'status': statuses[0]}))
+"""
+
+
+def start_worker(settings_module, environment, database, import_time=False):
+    """
+    :return: tuple of (the worker's timings, its stderr)
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module, **environment)
+    command = [sys.executable] + (['-X', 'importtime'] if import_time else []) + ['-c', WORKER, database]
+    worker = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(worker.stdout.splitlines()[-1]), worker.stderr
+
+
+def imports(stderr):
+    """
+    :param str stderr: output of python -X importtime
+    :return: tuple of (milliseconds spent importing, number of modules imported)
+    """
+    rows = [line.split('|') for line in stderr.splitlines() if line.startswith('import time:')][1:]
+    return round(sum(int(row[0].split(':')[1]) for row in rows) / 1000, 1), len(rows)
+
+
+def run(size, **options):
+    seed(rooms=10, movies=50, showtimes=1000, tickets=100)
+    database = connection.settings_dict['NAME']
+
+    # the profiles take turns, so a machine getting busier or quieter affects them alike
+    runs = {name: [] for name, _, _ in PROFILES}
+    for _ in range(size):
+        for name, settings_module, environment in PROFILES:
+            runs[name].append(start_worker(settings_module, environment, database)[0])
+
+    results = {'processes': size}
+    for name, settings_module, environment in PROFILES:
+        samples = runs[name]
+        setup = statistics.median(sample['setup'] for sample in samples)
+        first_request = statistics.median(sample['first_request'] for sample in samples)
+        results['{}.setup_ms'.format(name)] = round(setup * 1000, 1)
+        results['{}.first_request_ms'.format(name)] = round(first_request * 1000, 1)
+        results['{}.ready_ms'.format(name)] = round((setup + first_request) * 1000, 1)
+        results['{}.errors'.format(name)] = sum(not sample['status'].startswith('200') for sample in samples)
+
+        _, stderr = start_worker(settings_module, environment, database, import_time=True)
+        results['{}.import_ms'.format(name)], results['{}.modules'.format(name)] = imports(stderr)
+
+    for suffix, _ in ENVIRONMENTS:
+        results['api{}.speedup'.format(suffix)] = round(
+            results['full{}.ready_ms'.format(suffix)] / results['api{}.ready_ms'.format(suffix)], 2)
+    return results
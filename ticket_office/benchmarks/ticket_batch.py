@@ -0,0 +1,50 @@
+"""
+Buying tickets for N showtimes with N single POSTs versus one batch POST
+"""
+import datetime as dt
+
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ticket_office.benchmarks import timed
+from ticket_office.middleware import QueryRecorder
+from ticket_office.models import Movie, Room, Showtime, Ticket
+
+DEFAULT_SIZE = 200
+ROOMS = 10
+
+
+def run(size, **options):
+    client = APIClient()
+    rooms = [Room.objects.create(name='room {}'.format(i), capacity=100) for i in range(ROOMS)]
+    movie = Movie.objects.create(title='benchmark movie', duration=90)
+    start = (timezone.now() + dt.timedelta(days=1)).replace(minute=0, second=0, microsecond=0)
+    Showtime.objects.bulk_create([
+        Showtime(room=rooms[i % ROOMS], movie=movie, available=100,
+                 start_date=start + dt.timedelta(hours=2 * (i // ROOMS)),
+                 end_date=start + dt.timedelta(hours=2 * (i // ROOMS), minutes=90)) for i in range(size)])
+    showtime_ids = list(Showtime.objects.order_by('id').values_list('id', flat=True))
+    orders = [{'showtime': showtime_id, 'num_seats': 2} for showtime_id in showtime_ids]
+
+    single_queries = QueryRecorder(keep_sql=False)
+    with connection.execute_wrapper(single_queries):
+        single, _ = timed(lambda: [client.post('/tickets/', order, format='json') for order in orders])
+    assert Ticket.objects.count() == size
+
+    batch_queries = QueryRecorder(keep_sql=False)
+    with connection.execute_wrapper(batch_queries):
+        batch, response = timed(client.post, '/tickets/batch/', orders, format='json')
+    assert response.status_code == 201, response.data
+    assert Ticket.objects.count() == 2 * size
+
+    return {
+        'tickets': size,
+        'single_posts_seconds': round(single, 3),
+        'single_posts_queries': single_queries.count,
+        'single_tickets_per_second': round(size / single),
+        'batch_post_seconds': round(batch, 3),
+        'batch_post_queries': batch_queries.count,
+        'batch_tickets_per_second': round(size / batch),
+        'speedup': round(single / batch, 1),
+    }
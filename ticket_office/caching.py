@@ -0,0 +1,98 @@
+"""
+Versioned read-through cache for the API responses.
+
+Every model has a generation number stored in the cache. Cached payloads are keyed by the generations
+of all the models they are built from, so bumping a generation (done by the signals in
+ticket_office.signals) makes every dependent entry unreachable at once, without tracking or deleting
+individual keys. Stale entries simply age out of the cache.
+"""
+import time
+
+from django.core.cache import cache
+
+HITS_KEY = 'ticket_office:stats:hits'
+MISSES_KEY = 'ticket_office:stats:misses'
+
+
+def generation_key(model):
+    return 'ticket_office:generation:{}'.format(model._meta.label_lower)
+
+
+def new_generation():
+    # time based, so a generation lost to eviction or a restart never comes back with an old number
+    return time.time_ns()
+
+
+def bump_generation(*models):
+    """
+    Invalidate every cached payload built from any of these models
+
+    :param models: model classes that changed
+    """
+    now = new_generation()
+    for model in models:
+        try:
+            cache.incr(generation_key(model))
+        except ValueError:
+            cache.set(generation_key(model), now, None)
+
+
+def generations(models):
+    """
+    :param models: model classes
+    :return: list of their current generations, read in one go; a generation lost to eviction or a restart
+        starts again from the current time
+    """
+    keys = [generation_key(model) for model in models]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, new_generation(), None)
+            values[key] = cache.get(key)
+    return [values[key] for key in keys]
+
+
+def versioned_key(models, *parts):
+    """
+    Build a cache key that changes whenever any of the models changes
+
+    :param models: model classes the cached payload depends on
+    :param parts: anything else identifying the payload (action, id, query string)
+    :return: cache key
+    """
+    return ':'.join(['ticket_office'] + [str(generation) for generation in generations(models)]
+                    + [str(part) for part in parts])
+
+
+def get_or_build(key, build):
+    """
+    Read-through lookup that also counts hits and misses
+
+    :param str key: cache key, normally from versioned_key
+    :param build: callable returning the payload on a miss
+    :return: tuple of (payload, whether it was a hit)
+    """
+    payload = cache.get(key)
+    hit = payload is not None
+    count(HITS_KEY if hit else MISSES_KEY)
+    if not hit:
+        payload = build()
+        cache.set(key, payload)
+    return payload, hit
+
+
+def count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def stats():
+    """
+    :return: dict with hits, misses and the hit ratio since the counters were last reset
+    """
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counters.get(HITS_KEY, 0), counters.get(MISSES_KEY, 0)
+    return {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None}
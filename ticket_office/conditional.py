@@ -0,0 +1,97 @@
+"""
+Conditional GET for the schedule listings, which kiosks and CDNs poll far more often than they change.
+
+A listing's validators come from the database, shared by every worker: the latest updated_at of the
+showtimes, rooms and movies, three lookups on their updated_at indexes in one query. Added or edited rows
+move them, and so do deleted showtimes, which touch their room and movie (see ticket_office.signals). The
+seat sales don't, so a listing filtered on the seats available also sums them over the showtimes it shows,
+and has no Last-Modified. A listing whose window moves with the clock also depends on the next showtime to
+leave it and the next one to enter it, two lookups on the start_date index. A request carrying the current
+ETag or Last-Modified gets a 304 without the listing being built.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Subquery, Sum
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from ticket_office.models import Movie, Room, Showtime
+from ticket_office.snapshots import window_days
+
+
+def latest_change(model):
+    # read from the updated_at index
+    return Subquery(model.objects.order_by('-updated_at').values('updated_at')[:1])
+
+
+def schedule_changes():
+    """
+    :return: list of the latest updated_at of the showtimes, rooms and movies, empty when there is no showtime
+    """
+    row = Showtime.objects.order_by('-updated_at').annotate(rooms=latest_change(Room), movies=latest_change(Movie)) \
+        .values_list('updated_at', 'rooms', 'movies').first()
+    return list(row) if row is not None else []
+
+
+def next_start(moment):
+    """
+    :param datetime moment:
+    :return: start of the first showtime starting at or after the moment, None when there is none
+    """
+    return Showtime.objects.filter(start_date__gte=moment).order_by('start_date') \
+        .values_list('start_date', flat=True).first()
+
+
+def clock_version(start, end):
+    """
+    What a listing of the showtimes starting within a window that moves with the clock depends on besides
+    the tables: the business days of the window, the next showtime to start in it and the next one after it
+
+    :param datetime start: start of the window
+    :param datetime end: end of the window, None for no limit
+    :return: list of ISO dates and times, None where there is none
+    """
+    moments = list(window_days(start, end)) + [next_start(start), next_start(end) if end is not None else None]
+    return [moment.isoformat() if moment is not None else None for moment in moments]
+
+
+def validators(request, clock=(), availability=None):
+    """
+    :param request:
+    :param clock: clock_version() of the listing's window, when it moves with the clock
+    :param availability: queryset of the showtimes listed, when the listing depends on their seats available
+    :return: tuple of (ETag, Last-Modified datetime or None)
+    """
+    changes = schedule_changes()
+    version = changes + list(clock) + [request.get_full_path(), getattr(request, 'accepted_media_type', '')]
+    if availability is not None:
+        version.append(availability.order_by().aggregate(count=Count('id'), available=Sum('available')))
+    etag = quote_etag(hashlib.sha1(repr(version).encode()).hexdigest())
+    last_modified = max((change for change in changes if change is not None), default=None)
+    return etag, last_modified if availability is None else None
+
+
+def respond(request, build, clock=(), availability=None):
+    """
+    Answer a listing request with a 304 when the client's copy is current, build it otherwise. Either way
+    the response carries the validators and Cache-Control headers letting shared caches keep it for
+    LISTING_MAX_AGE seconds.
+
+    :param request:
+    :param build: callable returning the listing response
+    :param clock: clock_version() of the listing's window, when it moves with the clock
+    :param availability: queryset of the showtimes listed, when the listing depends on their seats available
+    :return: response
+    """
+    etag, last_modified = validators(request, clock, availability)
+    timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = build()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        patch_cache_control(response, public=True, max_age=settings.LISTING_MAX_AGE)
+    return response
@@ -0,0 +1,90 @@
+"""
+Streaming exports. Rows are read from values_list() queries with .iterator(), turned into NDJSON or CSV
+and written out in blocks as they arrive, so memory stays flat however many rows there are.
+"""
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework import serializers
+
+from ticket_office.models import showtime_label
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CHUNK_SIZE = 2000
+
+_datetime = serializers.DateTimeField()
+_date = serializers.DateField()
+
+
+def ticket_rows(tickets):
+    """
+    Tickets as (id, showtime, num_seats, seats), with the showtime formatted like TicketSerializer does
+    """
+    rows = tickets.order_by('id').values_list('id', 'showtime__room__name', 'showtime__movie__title',
+                                              'showtime__start_date', 'showtime__room__time_zone', 'num_seats',
+                                              'seats')
+    for ticket_id, room, movie, start, time_zone, num_seats, seats in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield ticket_id, showtime_label(room, movie, start, time_zone), num_seats, seats
+
+
+def showtime_rows(showtimes):
+    """
+    Showtimes as (id, room, movie, start_date, business_day), formatted like ShowtimeSerializer does
+    """
+    rows = showtimes.order_by('start_date', 'id').values_list('id', 'room__name', 'movie__title', 'start_date',
+                                                             'business_day')
+    for showtime_id, room, movie, start, day in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield showtime_id, room, movie, _datetime.to_representation(start), _date.to_representation(day)
+
+
+class Echo:
+    """
+    File-like object handing back whatever csv.writer writes to it
+    """
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(fields, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row))) + '\n'
+
+
+def csv_lines(fields, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def blocks(lines, size=CHUNK_SIZE):
+    """
+    Group lines so the server writes a few large chunks rather than one per row
+    """
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) == size:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
+
+
+def stream(fields, rows, output, filename):
+    """
+    :param list fields: column names
+    :param rows: iterable of tuples, one value per field
+    :param str output: 'ndjson' or 'csv'
+    :param str filename: name offered for download, without extension
+    :return: StreamingHttpResponse
+    """
+    lines = ndjson_lines(fields, rows) if output == 'ndjson' else csv_lines(fields, rows)
+    response = StreamingHttpResponse(blocks(lines), content_type=CONTENT_TYPES[output])
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, output)
+    return response
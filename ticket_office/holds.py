@@ -0,0 +1,129 @@
+"""
+Seat holds: seats taken from a showtime for a customer while they pay.
+
+A hold takes its seats the moment it is created, exactly like a sale (from the seat counter, the available
+column or the seat map), so the availability shown to everybody else already leaves them out. Confirming it
+before it expires turns it into a ticket; otherwise sweep(), run by the sweep_seat_holds worker, gives its
+seats back. The sweep reads the expired holds in batches from the (expires_at, id) index and releases each
+batch with one DELETE, one UPDATE of the available column of all its showtimes and one compare-and-swap per
+seat map, so holds that have not expired are never looked at, however many there are.
+"""
+import datetime as dt
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from ticket_office import seat_counters, seatmap
+from ticket_office.caching import bump_generation
+from ticket_office.models import SeatHold, SeatLayout, Showtime, Ticket
+
+
+def expiry(now=None):
+    """
+    :param datetime now: defaults to the current time
+    :return: when a hold created at now expires
+    """
+    return (now or timezone.now()) + dt.timedelta(seconds=settings.SEAT_HOLD_SECONDS)
+
+
+def release(holds):
+    """
+    Delete holds and give their seats back to the available column and the seat maps of their showtimes.
+    Must run inside a transaction, with the holds locked or read under it, so no confirmation deletes one
+    of them meanwhile.
+
+    :param list holds: (id, showtime id, number of seats, seats) rows of the holds
+    :return: dict of seats to give back to the seat counters per showtime id, once the transaction commits
+    """
+    showtime_ids = sorted({showtime_id for _, showtime_id, _, _ in holds})
+    Showtime.objects.lock(showtime_ids)
+    showtimes = {row[0]: row[1:] for row in Showtime.objects.filter(id__in=showtime_ids).values_list(
+        'id', 'seat_counter', 'room__seat_layout__rows', 'room__seat_layout__seats_per_row')}
+
+    freed, counted, picked = Counter(), Counter(), {}
+    for _, showtime_id, num_seats, seats in holds:
+        seat_counter, rows, seats_per_row = showtimes[showtime_id]
+        if rows is None and seat_counter:
+            counted[showtime_id] += num_seats
+            continue
+        freed[showtime_id] += num_seats
+        if rows is not None and seats:
+            picked.setdefault(showtime_id, []).extend(
+                seatmap.parse(label, rows, seats_per_row) for label in seats.split(','))
+
+    SeatHold.objects.filter(id__in=[hold[0] for hold in holds]).delete()
+    for showtime_id, seats in picked.items():
+        _, rows, seats_per_row = showtimes[showtime_id]
+        layout = SeatLayout(rows=rows, seats_per_row=seats_per_row)
+        # the row is locked (or the transaction holds the write lock), the compare-and-swap goes through
+        if not Showtime.objects.release_seats(showtime_id, layout, seats):
+            raise RuntimeError('The seat map of showtime {} kept changing'.format(showtime_id))
+    if freed:
+        Showtime.objects.filter(id__in=freed).update(available=F('available') + Case(
+            *[When(id=showtime_id, then=Value(seats)) for showtime_id, seats in freed.items()],
+            default=Value(0), output_field=IntegerField()))
+    # the queryset updates send no signal, invalidate the cached showtimes by hand
+    bump_generation(Showtime)
+    transaction.on_commit(lambda: bump_generation(Showtime))
+    return dict(counted)
+
+
+def sweep(now=None, batch_size=None):
+    """
+    Give back the seats of every hold expired at now, batch_size holds per transaction. Where the backend
+    supports it the batch is read with SELECT ... FOR UPDATE SKIP LOCKED, so several sweepers share the
+    work and a hold being confirmed is left to its confirmation.
+
+    :param datetime now: defaults to the current time
+    :param int batch_size: defaults to SEAT_HOLD_SWEEP_BATCH
+    :return: number of holds released
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.SEAT_HOLD_SWEEP_BATCH
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = SeatHold.objects.expired(now)
+            if connection.features.has_select_for_update_skip_locked:
+                expired = expired.select_for_update(skip_locked=True)
+            holds = list(expired.values_list('id', 'showtime_id', 'num_seats', 'seats')[:batch_size])
+            counted = release(holds) if holds else {}
+        seat_counters.give_back(counted)
+        released += len(holds)
+        if len(holds) < batch_size:
+            return released
+
+
+def cancel(hold_id):
+    """
+    Release a hold straight away, when the customer gives up
+
+    :param int hold_id: id of the hold
+    :return: True, False when it was already confirmed or released
+    """
+    with transaction.atomic():
+        holds = list(SeatHold.objects.filter(id=hold_id).select_for_update()
+                     .values_list('id', 'showtime_id', 'num_seats', 'seats'))
+        counted = release(holds) if holds else {}
+    seat_counters.give_back(counted)
+    return bool(holds)
+
+
+def confirm(hold_id, now=None):
+    """
+    Turn a hold into a ticket for the same seats, unless it expired. The hold is deleted with a
+    conditional DELETE, so a confirmation racing the sweeper either gets the seats or finds them gone.
+
+    :param int hold_id: id of the hold
+    :param datetime now: defaults to the current time
+    :return: the ticket, None when the hold expired or was already confirmed or released
+    """
+    with transaction.atomic():
+        hold = SeatHold.objects.filter(id=hold_id, expires_at__gt=now or timezone.now()).first()
+        if hold is None or not SeatHold.objects.filter(id=hold.id).delete()[0]:
+            return None
+        # the seats stay taken: they only move from the hold to the ticket
+        return Ticket.objects.create(showtime_id=hold.showtime_id, num_seats=hold.num_seats, seats=hold.seats)
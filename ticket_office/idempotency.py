@@ -0,0 +1,83 @@
+"""
+Idempotency-Key support for ticket purchases.
+
+Clients retrying POST /tickets/ after a timeout send the same Idempotency-Key header with every attempt.
+The response of the purchase is stored with the key in the same transaction as the sale, so a retry gets
+that response back after a single key lookup, without selling the seats twice. Only successful purchases
+are stored: a failed one changed nothing, and retrying it runs it again.
+"""
+import datetime as dt
+import hashlib
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from ticket_office.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used with a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+def request_key(request):
+    """
+    :param request:
+    :return: the Idempotency-Key of the request, None when it has none
+    """
+    key = request.headers.get(HEADER)
+    if key is not None and not 0 < len(key) <= IdempotencyKey._meta.get_field('key').max_length:
+        raise ValidationError({HEADER: 'Send between 1 and 255 characters.'})
+    return key
+
+
+def fingerprint(data):
+    """
+    :param data: request body
+    :return: sha256 of the body, the same for the same JSON whatever the key order
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def replay(key, request_hash):
+    """
+    Stored response of an earlier request with the same key
+
+    :param str key: Idempotency-Key
+    :param str request_hash: fingerprint of the request body
+    :return: Response, None when the key is new or expired
+    """
+    stored = IdempotencyKey.objects.filter(key=key).first()
+    if stored is None:
+        return None
+    if stored.expires_at <= timezone.now():
+        # expired and not swept yet, the key can be used again
+        stored.delete()
+        return None
+    if stored.request_hash != request_hash:
+        raise IdempotencyKeyReused()
+    return Response(json.loads(stored.response), status=stored.status_code, headers={REPLAYED_HEADER: 'true'})
+
+
+def remember(key, request_hash, status_code, data):
+    """
+    Store the response of a request. Call it inside the transaction doing the request's writes: when a
+    concurrent request with the same key got there first this raises IntegrityError, rolling them back
+
+    :param str key: Idempotency-Key
+    :param str request_hash: fingerprint of the request body
+    :param int status_code: response status
+    :param data: response body
+    """
+    IdempotencyKey.objects.create(key=key, request_hash=request_hash, status_code=status_code,
+                                  response=json.dumps(data, cls=JSONEncoder),
+                                  expires_at=timezone.now() + dt.timedelta(seconds=settings.IDEMPOTENCY_KEY_SECONDS))
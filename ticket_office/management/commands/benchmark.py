@@ -0,0 +1,59 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+
+from ticket_office.benchmarks import SCENARIOS, compare, run_scenario
+
+
+class Command(BaseCommand):
+    help = 'Run a performance scenario against a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--size', type=int, help='Workload size, the scenario picks a default otherwise')
+        parser.add_argument('--requests', type=int, help='Requests per endpoint (api, asgi)')
+        parser.add_argument('--concurrency', type=int, help='Concurrent clients (api, asgi, db_profiles, seat_counter)')
+        parser.add_argument('--workers', type=int, help='Server threads, WSGI workers or ASGI database pool (asgi)')
+        parser.add_argument('--url', help='Load test this running server instead of starting one (api)')
+        parser.add_argument('--baseline', help='JSON file with reference measurements to compare against')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Tolerated relative regression against the baseline, 0.2 for 20%%')
+        parser.add_argument('--save-baseline', help='Store the measurements of this run in this JSON file')
+
+    def handle(self, *args, **options):
+        scenario = options['scenario']
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            # scenario options left unset fall back to the scenario's own defaults
+            scenario_options = {name: options[name] for name in ('requests', 'concurrency', 'workers', 'url')
+                                if options[name] is not None}
+            results = run_scenario(scenario, options['size'], **scenario_options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        for name, value in results.items():
+            self.stdout.write('{}: {}'.format(name, value))
+
+        if options['save_baseline']:
+            baselines = self.load(options['save_baseline']) if os.path.exists(options['save_baseline']) else {}
+            baselines[scenario] = results
+            with open(options['save_baseline'], 'w') as baseline_file:
+                json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            baseline = self.load(options['baseline']).get(scenario)
+            if baseline is None:
+                raise CommandError('{} has no baseline for {}'.format(options['baseline'], scenario))
+            regressions = compare(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError('Regressed past {:.0%}:\n{}'.format(options['threshold'], '\n'.join(regressions)))
+            self.stdout.write(self.style.SUCCESS('No regression against the baseline'))
+
+    def load(self, path):
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ticket_office import snapshots
+
+
+class Command(BaseCommand):
+    help = 'Recreate the precomputed "now playing" listings from the showtimes'
+
+    def handle(self, *args, **options):
+        count = snapshots.rebuild()
+        self.stdout.write(self.style.SUCCESS('Rebuilt {} playing snapshots'.format(count)))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from ticket_office.caching import bump_generation
+from ticket_office.models import Showtime
+
+
+class Command(BaseCommand):
+    help = 'Recompute the available seats of every showtime that drifted from the tickets sold and the seats ' \
+           'held, in one grouped query, and report them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the showtimes that drifted')
+
+    def handle(self, *args, **options):
+        drifted = Showtime.objects.with_seats_sold().annotate(
+            expected=F('room__capacity') - F('seats_sold') - F('seats_held')) \
+            .exclude(available=F('expected')).order_by('id')
+        for showtime_id, available, expected in drifted.values_list('id', 'available', 'expected'):
+            self.stdout.write('Showtime {}: {} seats available, {} according to the tickets and holds'.format(
+                showtime_id, available, expected))
+        if options['dry_run']:
+            return
+
+        with transaction.atomic():
+            # the sales of these showtimes queue up behind the lock, so none is in flight when they are summed
+            showtimes = Showtime.objects.filter(id__in=drifted.values('id'))
+            Showtime.objects.lock(showtimes.values_list('id', flat=True))
+            count = showtimes.reconcile_available()
+        if count:
+            # the queryset update sends no signal, invalidate the cached showtimes by hand
+            bump_generation(Showtime)
+        self.stdout.write(self.style.SUCCESS('Reconciled the availability of {} showtimes'.format(count)))
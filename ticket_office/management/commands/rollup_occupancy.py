@@ -0,0 +1,30 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand
+
+from ticket_office import analytics
+
+
+class Command(BaseCommand):
+    help = 'Roll up the showtimes and tickets of the closed business days for the analytics, run it nightly ' \
+           '(e.g. from cron). Days rolled up before are recomputed too, to take in late changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+                            help='Recompute the last DAYS closed business days, even if already rolled up')
+        parser.add_argument('--all', action='store_true', help='Recompute every closed business day')
+
+    def handle(self, *args, **options):
+        last = analytics.closed_through()
+        rolled = analytics.rolled_through()
+        if options['all'] or rolled is None:
+            first = analytics.first_day()
+        else:
+            first = min(rolled + dt.timedelta(days=1), last - dt.timedelta(days=options['days'] - 1))
+        if first is None or first > last:
+            self.stdout.write('No closed business day to roll up')
+            return
+
+        count = analytics.rollup(first, last)
+        self.stdout.write(self.style.SUCCESS('Rolled up business days {} to {} into {} rows'.format(
+            first, last, count)))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ticket_office import seat_counters
+
+
+class Command(BaseCommand):
+    help = 'Manage the write-behind seat counters of hot showtimes: turn them on or off, write them back to ' \
+           'the database (run "flush" periodically) or rebuild them from the tickets after a crash'
+
+    def add_arguments(self, parser):
+        parser.add_argument('operation', choices=['enable', 'disable', 'flush', 'recover'])
+        parser.add_argument('showtime_ids', nargs='*', type=int, help='Showtimes to enable or disable')
+
+    def handle(self, *args, **options):
+        operation, showtime_ids = options['operation'], options['showtime_ids']
+        if operation in ('enable', 'disable') and not showtime_ids:
+            raise CommandError('Give the ids of the showtimes to {}'.format(operation))
+
+        if operation == 'enable':
+            try:
+                count = seat_counters.enable(showtime_ids)
+            except ValueError as error:
+                raise CommandError(error)
+            message = 'Selling {} showtimes from seat counters'
+        elif operation == 'disable':
+            count = seat_counters.disable(showtime_ids)
+            message = 'Selling {} showtimes from the database again'
+        elif operation == 'flush':
+            count = seat_counters.flush()
+            message = 'Wrote the availability of {} showtimes back to the database'
+        else:
+            count = seat_counters.recover()
+            message = 'Rebuilt {} seat counters from the tickets sold'
+        self.stdout.write(self.style.SUCCESS(message.format(count)))
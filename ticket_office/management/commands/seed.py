@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from ticket_office.benchmarks.seed import seed
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a realistic catalogue of rooms, movies, showtimes and tickets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=50)
+        parser.add_argument('--movies', type=int, default=2000)
+        parser.add_argument('--showtimes', type=int, default=200000)
+        parser.add_argument('--tickets', type=int, default=20000)
+        parser.add_argument('--random-seed', type=int, default=0, help='Same seed, same catalogue')
+
+    def handle(self, *args, **options):
+        created = seed(rooms=options['rooms'], movies=options['movies'], showtimes=options['showtimes'],
+                       tickets=options['tickets'], random_seed=options['random_seed'])
+        self.stdout.write(self.style.SUCCESS(
+            'Created {rooms} rooms, {movies} movies, {showtimes} showtimes and {tickets} tickets'.format(**created)))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+
+from ticket_office.models import OVERLAP_CONSTRAINT
+
+DROP = 'ALTER TABLE ticket_office_showtime DROP CONSTRAINT IF EXISTS {}'.format(OVERLAP_CONSTRAINT)
+ADD = 'ALTER TABLE ticket_office_showtime ADD CONSTRAINT {} EXCLUDE USING gist ' \
+      "(room_id WITH =, tstzrange(start_date, end_date, '[]') WITH &&)".format(OVERLAP_CONSTRAINT)
+
+
+class Command(BaseCommand):
+    help = 'Add or remove the Postgres exclusion constraint (btree_gist) with which the database itself ' \
+           'rejects overlapping showtimes in a room'
+
+    def add_arguments(self, parser):
+        parser.add_argument('operation', choices=['add', 'remove'])
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The exclusion constraint needs Postgres')
+
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(DROP)
+                if options['operation'] == 'add':
+                    cursor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+                    cursor.execute(ADD)
+        except IntegrityError:
+            raise CommandError('Some showtimes already overlap, reschedule them first')
+        self.stdout.write(self.style.SUCCESS('{} {}'.format(
+            'Added' if options['operation'] == 'add' else 'Removed', OVERLAP_CONSTRAINT)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ticket_office.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete the expired idempotency keys of ticket purchases, run it periodically (e.g. from cron)'
+
+    def handle(self, *args, **options):
+        count = IdempotencyKey.objects.sweep()
+        self.stdout.write(self.style.SUCCESS('Deleted {} expired idempotency keys'.format(count)))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ticket_office import holds
+
+
+class Command(BaseCommand):
+    help = 'Give back the seats of the expired seat holds, once or as a worker sweeping every few seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help='Keep running, sweeping every SECONDS, instead of sweeping once')
+        parser.add_argument('--batch-size', type=int, help='Holds released per transaction, '
+                                                           'SEAT_HOLD_SWEEP_BATCH by default')
+
+    def handle(self, *args, **options):
+        while True:
+            count = holds.sweep(batch_size=options['batch_size'])
+            if count or not options['every']:
+                self.stdout.write(self.style.SUCCESS('Released {} expired seat holds'.format(count)))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
@@ -0,0 +1,105 @@
+"""
+In-process request metrics, exposed in the Prometheus text format at /metrics.
+
+Every worker process keeps its own histograms; a Prometheus server scraping each worker (or anything
+reading the endpoint) gets the figures of that process since it started.
+"""
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in pairs) + '}'
+
+
+class Histogram:
+    """
+    Prometheus style histogram, one series per combination of label values
+    """
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """
+        :param tuple labels: one value per label name
+        :param float value: observed value
+        """
+        with self.lock:
+            counts = self.series.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            series = sorted((labels, list(counts)) for labels, counts in self.series.items())
+        for labels, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels(self.labels, labels, le=bound),
+                                                     cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labels, labels), counts[-1]))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(self.labels, labels), cumulative))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        with self.lock:
+            series = sorted(self.series.items())
+        for labels, value in series:
+            lines.append('{}{} {}'.format(self.name, format_labels(self.labels, labels), value))
+        return lines
+
+
+ROUTE_LABELS = ('view', 'method')
+
+requests_total = Counter('ticket_office_requests_total', 'Requests served', ROUTE_LABELS + ('status',))
+request_seconds = Histogram('ticket_office_request_seconds', 'Total request latency in seconds',
+                            ROUTE_LABELS, LATENCY_BUCKETS)
+db_seconds = Histogram('ticket_office_db_seconds', 'Time spent running SQL per request in seconds',
+                       ROUTE_LABELS, LATENCY_BUCKETS)
+db_queries = Histogram('ticket_office_db_queries', 'SQL queries per request', ROUTE_LABELS, QUERY_BUCKETS)
+serialization_seconds = Histogram('ticket_office_serialization_seconds',
+                                  'Time spent rendering the response payload per request in seconds',
+                                  ROUTE_LABELS, LATENCY_BUCKETS)
+
+REGISTRY = [requests_total, request_seconds, db_seconds, db_queries, serialization_seconds]
+
+
+def render(extra_lines=()):
+    """
+    :param extra_lines: more metrics lines to append
+    :return: every metric in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    lines += extra_lines
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,96 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from ticket_office import metrics
+
+slow_requests = logging.getLogger('ticket_office.slow_requests')
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper hook counting and timing the SQL of one request
+    """
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.seconds = 0.0
+        self.keep_sql = keep_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - began
+            self.count += 1
+            self.seconds += elapsed
+            if self.keep_sql:
+                self.statements.append((elapsed, sql, params))
+
+
+def record(request, view_name, status_code, elapsed, recorder, serialization_seconds):
+    """
+    Record one request into the histograms of ticket_office.metrics, and log it when it was slow
+
+    :param request:
+    :param str view_name: URL name of the view that served it
+    :param int status_code: response status
+    :param float elapsed: total latency in seconds
+    :param QueryRecorder recorder: SQL run for the request
+    :param float serialization_seconds: time spent rendering the response
+    """
+    labels = (view_name, request.method)
+    if view_name != 'metrics':
+        metrics.requests_total.inc(labels + (str(status_code),))
+        metrics.request_seconds.observe(labels, elapsed)
+        metrics.db_seconds.observe(labels, recorder.seconds)
+        metrics.db_queries.observe(labels, recorder.count)
+        metrics.serialization_seconds.observe(labels, serialization_seconds)
+
+    slow_threshold = getattr(settings, 'SLOW_REQUEST_SECONDS', None)
+    if slow_threshold is not None and elapsed >= slow_threshold:
+        slow_requests.warning(
+            'Slow request %s %s (%s): %.3fs total, %d queries in %.3fs\n%s',
+            request.method, request.get_full_path(), view_name, elapsed, recorder.count, recorder.seconds,
+            '\n'.join('{:.4f}s {} {}'.format(seconds, sql, params) for seconds, sql, params in recorder.statements))
+
+
+class MetricsMiddleware:
+    """
+    Record, per view, the SQL query count, DB time, serialization (response rendering) time and total
+    latency of every request into the histograms of ticket_office.metrics.
+
+    With SLOW_REQUEST_SECONDS set, requests slower than that are logged to ticket_office.slow_requests
+    together with the SQL they ran.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(keep_sql=getattr(settings, 'SLOW_REQUEST_SECONDS', None) is not None)
+        request._serialization_seconds = 0.0
+
+        began = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - began
+
+        match = request.resolver_match
+        record(request, match.view_name if match else 'unmatched', response.status_code, elapsed, recorder,
+               request._serialization_seconds)
+        return response
+
+    def process_template_response(self, request, response):
+        """
+        DRF responses are rendered after the view returns; time the rendering
+        """
+        began = time.perf_counter()
+
+        def rendered(response):
+            request._serialization_seconds += time.perf_counter() - began
+
+        response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='showtime',
+            index=models.Index(fields=['room', 'start_date'], name='showtime_room_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='showtime',
+            index=models.Index(fields=['room', 'end_date'], name='showtime_room_end_idx'),
+        ),
+    ]
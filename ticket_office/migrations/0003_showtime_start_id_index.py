@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0002_showtime_room_interval_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='showtime',
+            index=models.Index(fields=['start_date', 'id'], name='showtime_start_id_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.0 on 2026-10-18 11:46
+
+import json
+
+from django.db import migrations, models
+
+
+def build_snapshots(apps, schema_editor):
+    # frozen copy of the snapshot build of the time: one row per room or movie and UTC start date
+    Showtime = apps.get_model('ticket_office', 'Showtime')
+    PlayingSnapshot = apps.get_model('ticket_office', 'PlayingSnapshot')
+    groups = {}
+    for room_id, room_name, capacity, movie_id, title, duration, start in Showtime.objects.order_by(
+            'start_date', 'id').values_list('room_id', 'room__name', 'room__capacity', 'movie_id', 'movie__title',
+                                            'movie__duration', 'start_date').iterator(chunk_size=1000):
+        entry = [start.isoformat(), f"{room_name} {title} {start}"]
+        for kind, object_id, name, size in (('room', room_id, room_name, capacity),
+                                            ('movie', movie_id, title, duration)):
+            groups.setdefault((kind, object_id, start.date()), {'name': name, 'size': size, 'showtimes': []})[
+                'showtimes'].append(entry)
+    PlayingSnapshot.objects.bulk_create([
+        PlayingSnapshot(kind=kind, object_id=object_id, day=day, name=group['name'], size=group['size'],
+                        showtimes=json.dumps(group['showtimes']))
+        for (kind, object_id, day), group in groups.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0003_showtime_start_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayingSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('room', 'Room'), ('movie', 'Movie')], max_length=5)),
+                ('object_id', models.IntegerField()),
+                ('day', models.DateField()),
+                ('name', models.CharField(max_length=200)),
+                ('size', models.IntegerField(help_text="room's capacity or movie's duration")),
+                ('showtimes', models.TextField(help_text='JSON list of [start date, showtime label] pairs')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='playingsnapshot',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id', 'day'), name='playing_snapshot_unique'),
+        ),
+        migrations.RunPython(build_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0 on 2026-10-18 11:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0004_playingsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='showtime',
+            name='occupancy',
+            field=models.BinaryField(help_text='bitmap of taken seats, see seatmap', null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='seats',
+            field=models.TextField(blank=True, default='', help_text='comma separated seat labels, like "C7,C8"'),
+        ),
+        migrations.CreateModel(
+            name='SeatLayout',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rows', models.IntegerField()),
+                ('seats_per_row', models.IntegerField()),
+                ('room', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='seat_layout', to='ticket_office.Room')),
+            ],
+        ),
+    ]
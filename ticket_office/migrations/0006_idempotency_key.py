@@ -0,0 +1,24 @@
+# Generated by Django 3.0 on 2026-10-18 12:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0005_seat_layout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('request_hash', models.CharField(help_text='sha256 of the request body', max_length=64)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('response', models.TextField(help_text='JSON response body')),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0 on 2026-10-18 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0006_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='showtime',
+            name='seat_counter',
+            field=models.BooleanField(default=False, help_text='sell from a write-behind counter in the cache, see seat_counters'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0007_showtime_seat_counter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['showtime', 'num_seats'], name='ticket_showtime_seats_idx'),
+        ),
+    ]
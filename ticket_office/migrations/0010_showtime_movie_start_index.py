@@ -0,0 +1,17 @@
+# Generated by Django 3.0 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0009_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='showtime',
+            index=models.Index(fields=['movie', 'start_date'], name='showtime_movie_start_idx'),
+        ),
+    ]
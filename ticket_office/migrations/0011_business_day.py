@@ -0,0 +1,115 @@
+import datetime as dt
+import json
+
+import pytz
+from django.conf import settings
+from django.db import migrations, models
+import django.utils.timezone
+import ticket_office.models
+
+
+# frozen copies of ticket_office.models.local_time and business_day as of this migration
+def local_time(moment, time_zone):
+    if django.utils.timezone.is_naive(moment):
+        moment = django.utils.timezone.make_aware(moment, is_dst=False)
+    return django.utils.timezone.localtime(moment, pytz.timezone(time_zone))
+
+
+def business_day(moment, time_zone):
+    return (local_time(moment, time_zone) - dt.timedelta(hours=settings.BUSINESS_DAY_START_HOUR)).date()
+
+
+# the time zone the naive start and end dates were written in before USE_TZ, Django's default TIME_ZONE
+LEGACY_TIME_ZONE = 'America/Chicago'
+
+
+def convert_schedule(apps, convert):
+    Showtime = apps.get_model('ticket_office', 'Showtime')
+    showtimes = [Showtime(id=showtime_id, start_date=convert(start), end_date=convert(end))
+                 for showtime_id, start, end in Showtime.objects.values_list('id', 'start_date', 'end_date')]
+    Showtime.objects.bulk_update(showtimes, ['start_date', 'end_date'], batch_size=500)
+
+
+def schedule_to_utc(apps, schema_editor):
+    # the stored values are read as UTC now, their wall-clock time is the legacy time zone's
+    legacy = pytz.timezone(LEGACY_TIME_ZONE)
+    convert_schedule(apps, lambda moment: legacy.localize(moment.replace(tzinfo=None), is_dst=False)
+                     .astimezone(pytz.utc))
+
+
+def schedule_to_legacy(apps, schema_editor):
+    legacy = pytz.timezone(LEGACY_TIME_ZONE)
+    convert_schedule(apps, lambda moment: moment.astimezone(legacy).replace(tzinfo=pytz.utc))
+
+
+def fill_business_days(apps, schema_editor):
+    Showtime = apps.get_model('ticket_office', 'Showtime')
+    showtimes = [Showtime(id=showtime_id, business_day=business_day(start, time_zone))
+                 for showtime_id, start, time_zone in Showtime.objects.values_list('id', 'start_date', 'room__time_zone')]
+    Showtime.objects.bulk_update(showtimes, ['business_day'], batch_size=500)
+
+
+def build_snapshots(apps, schema_editor):
+    # frozen copy of the snapshot rebuild: one row per room or movie and business day, labelled in the
+    # room's time zone
+    Showtime = apps.get_model('ticket_office', 'Showtime')
+    PlayingSnapshot = apps.get_model('ticket_office', 'PlayingSnapshot')
+    groups = {}
+    for room_id, room_name, capacity, time_zone, movie_id, title, duration, start, day in Showtime.objects.order_by(
+            'start_date', 'id').values_list('room_id', 'room__name', 'room__capacity', 'room__time_zone', 'movie_id',
+                                            'movie__title', 'movie__duration', 'start_date', 'business_day') \
+            .iterator(chunk_size=1000):
+        entry = [start.isoformat(), f"{room_name} {title} {local_time(start, time_zone)}"]
+        for kind, object_id, name, size in (('room', room_id, room_name, capacity),
+                                            ('movie', movie_id, title, duration)):
+            groups.setdefault((kind, object_id, day), {'name': name, 'size': size, 'showtimes': []})[
+                'showtimes'].append(entry)
+    PlayingSnapshot.objects.all().delete()
+    PlayingSnapshot.objects.bulk_create([
+        PlayingSnapshot(kind=kind, object_id=object_id, day=day, name=group['name'], size=group['size'],
+                        showtimes=json.dumps(group['showtimes']))
+        for (kind, object_id, day), group in groups.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0010_showtime_movie_start_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='city',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='time_zone',
+            field=models.CharField(default=ticket_office.models.default_time_zone, help_text='name of the time zone of the room, like "America/Bogota"', max_length=63, validators=[ticket_office.models.validate_time_zone]),
+        ),
+        migrations.AlterField(
+            model_name='showtime',
+            name='start_date',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='showtime',
+            name='business_day',
+            field=models.DateField(editable=False, null=True),
+        ),
+        # USE_TZ is on from here, in UTC
+        migrations.RunPython(schedule_to_utc, schedule_to_legacy),
+        migrations.RunPython(fill_business_days, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='showtime',
+            name='business_day',
+            field=models.DateField(editable=False, help_text='day the showtime counts toward, see business_day()'),
+        ),
+        migrations.AddIndex(
+            model_name='showtime',
+            index=models.Index(fields=['business_day', 'room'], name='showtime_day_room_idx'),
+        ),
+        # the snapshots are now keyed by business day
+        migrations.RunPython(build_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.0 on 2026-10-18 13:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0011_business_day'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatHold',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_seats', models.IntegerField(default=1, verbose_name='Number of seats')),
+                ('seats', models.TextField(blank=True, default='', help_text='comma separated seat labels, like "C7,C8"')),
+                ('expires_at', models.DateTimeField()),
+                ('showtime', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ticket_office.Showtime')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='seathold',
+            index=models.Index(fields=['expires_at', 'id'], name='seat_hold_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='seathold',
+            index=models.Index(fields=['showtime', 'num_seats'], name='seat_hold_showtime_seats_idx'),
+        ),
+    ]
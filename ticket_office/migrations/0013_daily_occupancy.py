@@ -0,0 +1,31 @@
+# Generated by Django 3.0 on 2026-10-18 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0012_seat_hold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOccupancy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('business_day', models.DateField()),
+                ('showtimes', models.IntegerField()),
+                ('capacity', models.IntegerField(help_text='seats on sale, the capacity of the room summed over the showtimes')),
+                ('seats_sold', models.IntegerField()),
+                ('tickets', models.IntegerField()),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ticket_office.Movie')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ticket_office.Room')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyoccupancy',
+            constraint=models.UniqueConstraint(fields=('business_day', 'room', 'movie'), name='daily_occupancy_unique'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+import sqlite3
+
+from django.db import migrations
+
+# frozen names, ticket_office.search.FTS_TABLE and POSTGRES_INDEX as of this migration
+FTS_TABLE = 'ticket_office_movie_fts'
+POSTGRES_INDEX = 'movie_title_search_idx'
+
+
+def backend(connection):
+    if connection.vendor == 'sqlite':
+        with sqlite3.connect(':memory:') as probe:
+            if ('ENABLE_FTS5',) in probe.execute('PRAGMA compile_options').fetchall():
+                return 'fts5'
+    if connection.vendor == 'postgresql':
+        return 'postgres'
+    return None
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Index the movie titles for ticket_office.search: an FTS5 table on SQLite, filled here and kept in sync by
+    the Movie signals, a GIN index on their tsvector on Postgres
+    """
+    kind = backend(schema_editor.connection)
+    if kind == 'fts5':
+        Movie = apps.get_model('ticket_office', 'Movie')
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE {} USING fts5(title, prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+            .format(FTS_TABLE))
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany('INSERT INTO {}(rowid, title) VALUES (%s, %s)'.format(FTS_TABLE),
+                               list(Movie.objects.values_list('id', 'title')))
+    elif kind == 'postgres':
+        schema_editor.execute("CREATE INDEX {} ON ticket_office_movie USING gin (to_tsvector('simple', title))"
+                              .format(POSTGRES_INDEX))
+
+
+def drop_search_index(apps, schema_editor):
+    kind = backend(schema_editor.connection)
+    if kind == 'fts5':
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(FTS_TABLE))
+    elif kind == 'postgres':
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(POSTGRES_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket_office', '0013_daily_occupancy'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,41 +1,523 @@
 import datetime as dt
-from django.db import models
+
+import pytz
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ticket_office import seatmap
+
+
+def default_time_zone():
+    return settings.TIME_ZONE
+
+
+def validate_time_zone(value):
+    if value not in pytz.all_timezones_set:
+        raise ValidationError('Unknown time zone, use a name like "America/Bogota".')
+
+
+def local_time(moment, time_zone):
+    """
+    :param datetime moment: a naive moment is taken to be in the current time zone
+    :param str time_zone: name of the time zone
+    :return: moment on the wall clocks of time_zone
+    """
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, is_dst=False)
+    return timezone.localtime(moment, pytz.timezone(time_zone))
+
+
+def showtime_label(room_name, movie_title, start, time_zone):
+    """
+    :return: how a showtime is shown to customers, with its start on the clocks of its room
+    """
+    return f"{room_name} {movie_title} {local_time(start, time_zone)}"
+
+
+def business_day(moment, time_zone):
+    """
+    Business day a showtime counts toward: the date it starts on in its room's time zone, or the day before
+    when it starts after midnight but before BUSINESS_DAY_START_HOUR
+
+    :param datetime moment: start of the showtime
+    :param str time_zone: name of the room's time zone
+    :return: date
+    """
+    return (local_time(moment, time_zone) - dt.timedelta(hours=settings.BUSINESS_DAY_START_HOUR)).date()
 
 
 class Room(models.Model):
     name = models.CharField(max_length=50)
     capacity = models.IntegerField()
+    city = models.CharField(max_length=100, blank=True, default='', db_index=True)
+    time_zone = models.CharField(max_length=63, default=default_time_zone, validators=[validate_time_zone],
+                                 help_text='name of the time zone of the room, like "America/Bogota"')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
 
+class SeatLayout(models.Model):
+    """
+    Seats of a room laid out as a grid, which lets customers pick their seats
+    """
+    room = models.OneToOneField(Room, on_delete=models.CASCADE, related_name='seat_layout')
+    rows = models.IntegerField()
+    seats_per_row = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.room.name} {self.rows}x{self.seats_per_row}"
+
+
 class Movie(models.Model):
     title = models.CharField(max_length=200)
     duration = models.IntegerField(verbose_name="duration (minutes)", default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.title
 
 
+class ShowtimeQuerySet(models.QuerySet):
+
+    def overlapping(self, room, start, end):
+        """
+        Showtimes in a room whose [start_date, end_date] interval intersects [start, end]. Two interval
+        bounds cover every case (partial overlap on either side, containment in both directions) and are
+        answered from the (room, start_date) / (room, end_date) indexes.
+
+        :param room: room instance or id
+        :param datetime start: start of the interval
+        :param datetime end: end of the interval
+        :return: queryset of the overlapping showtimes
+        """
+        return self.filter(room=room, start_date__lte=end, end_date__gte=start)
+
+    def scheduled(self, start=None, end=None, room=None, movie=None, min_available=None, day=None, city=None):
+        """
+        Showtimes matching the filters of the showtime listing, every filter optional. The start date range
+        is answered from the (start_date, id) index, or from (room, start_date) / (movie, start_date) when
+        the room or movie is given, and a business day is a single equality on the (business_day, room)
+        index.
+
+        :param datetime start: starting from this moment
+        :param datetime end: starting up to this moment
+        :param int room: room id
+        :param int movie: movie id
+        :param int min_available: with at least this many seats left
+        :param date day: counting toward this business day
+        :param str city: in a room of this city
+        :return: queryset
+        """
+        filters = {}
+        if day is not None:
+            filters['business_day'] = day
+        if city is not None:
+            filters['room__city'] = city
+        if start is not None:
+            filters['start_date__gte'] = start
+        if end is not None:
+            filters['start_date__lte'] = end
+        if room is not None:
+            filters['room'] = room
+        if movie is not None:
+            filters['movie'] = movie
+        if min_available is not None:
+            filters['available__gte'] = min_available
+        return self.filter(**filters)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        bulk_create does not call save(), fill in the business day of the showtimes that have none, with one
+        query for the time zones of their rooms
+        """
+        objs = list(objs)
+        missing = [showtime for showtime in objs if showtime.business_day is None]
+        if missing:
+            time_zones = dict(Room.objects.filter(id__in={showtime.room_id for showtime in missing})
+                              .values_list('id', 'time_zone'))
+            for showtime in missing:
+                showtime.business_day = business_day(showtime.start_date, time_zones[showtime.room_id])
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def refresh_business_days(self):
+        """
+        Recompute the business day of these showtimes, needed when their room moves to another time zone
+
+        :return: number of showtimes moved to another business day
+        """
+        moved = []
+        for showtime_id, start, time_zone, day in self.values_list('id', 'start_date', 'room__time_zone',
+                                                                   'business_day'):
+            new_day = business_day(start, time_zone)
+            if new_day != day:
+                moved.append(self.model(id=showtime_id, business_day=new_day))
+        self.model.objects.bulk_update(moved, ['business_day'], batch_size=500)
+        return len(moved)
+
+    def reserve(self, showtime_id, seats):
+        """
+        Take seats from a showtime with a single conditional UPDATE. Must run inside a transaction
+        together with the ticket insert so both land or neither does.
+
+        With TICKET_RESERVATION_SKIP_LOCKED enabled on a backend that supports it (Postgres), the row
+        is claimed with SELECT ... FOR UPDATE SKIP LOCKED first, so a sale that finds the showtime
+        busy fails fast instead of queueing behind the other writers.
+
+        :param int showtime_id: id of the showtime to take the seats from
+        :param int seats: number of seats to take
+        :return: 'reserved', 'busy' when the row is locked by another sale, or 'sold_out'
+        """
+        queryset = self.filter(id=showtime_id)
+        if getattr(settings, 'TICKET_RESERVATION_SKIP_LOCKED', False) \
+                and connection.features.has_select_for_update_skip_locked:
+            if not queryset.select_for_update(skip_locked=True).values_list('id', flat=True):
+                return 'busy'
+
+        if queryset.filter(available__gte=seats).update(available=F('available') - seats):
+            return 'reserved'
+        return 'sold_out'
+
+    def claim_seats(self, showtime_id, layout, count, seats=None, attempts=5):
+        """
+        Claim seats in the occupancy bitmap of a showtime with a seat layout. The new bitmap is written
+        with a compare-and-swap UPDATE (WHERE occupancy = the bitmap it was computed from), retried when
+        another sale got in between, so no row lock is held while seats are picked.
+
+        :param int showtime_id: id of the showtime
+        :param SeatLayout layout: seat layout of the showtime's room
+        :param int count: number of seats to claim
+        :param list seats: seat numbers chosen by the customer, the first free block of count adjacent
+            seats (or failing that the first free ones) when None
+        :param int attempts: compare-and-swap attempts before giving up
+        :return: tuple of 'reserved', 'taken' (a chosen seat is not free), 'sold_out' or 'busy', and the
+            list of claimed seat numbers
+        """
+        capacity = layout.rows * layout.seats_per_row
+        for _ in range(attempts):
+            occupancy = self.filter(id=showtime_id).values_list('occupancy', flat=True).get()
+            taken = seatmap.decode(occupancy)
+            if seats is not None:
+                claim = seatmap.mask(seats)
+                if taken & claim:
+                    return 'taken', []
+            else:
+                claim = seatmap.find_block(taken, layout.rows, layout.seats_per_row, count) \
+                    or seatmap.first_free(taken, capacity, count)
+                if claim is None:
+                    return 'sold_out', []
+
+            current = {'occupancy__isnull': True} if occupancy is None else {'occupancy': occupancy}
+            claimed = self.filter(id=showtime_id, available__gte=count, **current) \
+                .update(occupancy=seatmap.encode(taken | claim, capacity), available=F('available') - count)
+            if claimed:
+                return 'reserved', seatmap.seat_numbers(claim)
+        return 'busy', []
+
+    def reserve_many(self, orders, counted=()):
+        """
+        Take the seats of several orders, possibly for several showtimes, at once. Must run inside a
+        transaction that is rolled back unless every order is reserved.
+
+        The showtime rows are locked with SELECT ... FOR UPDATE in id order, where the backend supports it,
+        so two batches sharing showtimes queue up instead of deadlocking. Each showtime is then written
+        with one conditional UPDATE for all of its orders: on the availability for rooms without a seat
+        layout, and as a compare-and-swap of the occupancy bitmap for the others.
+
+        :param list orders: (showtime, number of seats, chosen seat numbers or None) tuples, the showtimes
+            with their room's seat layout loaded
+        :param counted: ids of the showtimes whose seats were already taken from their seat counter, left
+            alone here
+        :return: list of (status, claimed seat numbers) per order, in order. Status is 'reserved', 'taken'
+            (a chosen seat is not free), 'sold_out' or 'busy' (a seat map changed under a backend
+            without row locks)
+        """
+        showtime_ids = sorted({showtime.id for showtime, _, _ in orders} - set(counted))
+        results = [('reserved', [])] * len(orders)
+        if not showtime_ids:
+            return results
+        rows = self.filter(id__in=showtime_ids).order_by('id')
+        if connection.features.has_select_for_update:
+            rows = rows.select_for_update()
+        occupancies = dict(rows.values_list('id', 'occupancy'))
+
+        by_showtime = {}
+        for index, (showtime, count, seats) in enumerate(orders):
+            by_showtime.setdefault(showtime.id, []).append(index)
+
+        for showtime_id in showtime_ids:
+            indexes = by_showtime[showtime_id]
+            showtime = orders[indexes[0]][0]
+            total = sum(orders[index][1] for index in indexes)
+            layout = getattr(showtime.room, 'seat_layout', None)
+            if layout is None:
+                if not self.filter(id=showtime_id, available__gte=total).update(available=F('available') - total):
+                    for index in indexes:
+                        results[index] = ('sold_out', [])
+                continue
+
+            capacity = layout.rows * layout.seats_per_row
+            occupancy = occupancies.get(showtime_id)
+            taken = seatmap.decode(occupancy)
+            for index in indexes:
+                _, count, seats = orders[index]
+                if seats is not None:
+                    claim = seatmap.mask(seats)
+                    if taken & claim:
+                        results[index] = ('taken', [])
+                        continue
+                else:
+                    claim = seatmap.find_block(taken, layout.rows, layout.seats_per_row, count) \
+                        or seatmap.first_free(taken, capacity, count)
+                    if claim is None:
+                        results[index] = ('sold_out', [])
+                        continue
+                taken |= claim
+                results[index] = ('reserved', seatmap.seat_numbers(claim))
+            if any(results[index][0] != 'reserved' for index in indexes):
+                continue
+
+            current = {'occupancy__isnull': True} if occupancy is None else {'occupancy': occupancy}
+            if not self.filter(id=showtime_id, available__gte=total, **current) \
+                    .update(occupancy=seatmap.encode(taken, capacity), available=F('available') - total):
+                for index in indexes:
+                    results[index] = ('busy', [])
+        return results
+
+    def release_seats(self, showtime_id, layout, seats, attempts=5):
+        """
+        Free seats in the occupancy bitmap of a showtime with a seat layout, with the same compare-and-swap
+        UPDATE as claim_seats. The available column is left to reconcile_available.
+
+        :param int showtime_id: id of the showtime
+        :param SeatLayout layout: seat layout of the showtime's room
+        :param list seats: seat numbers to free
+        :param int attempts: compare-and-swap attempts before giving up
+        :return: True once released, False when other sales kept changing the bitmap
+        """
+        capacity = layout.rows * layout.seats_per_row
+        for _ in range(attempts):
+            occupancy = self.filter(id=showtime_id).values_list('occupancy', flat=True).get()
+            current = {'occupancy__isnull': True} if occupancy is None else {'occupancy': occupancy}
+            freed = seatmap.decode(occupancy) & ~seatmap.mask(seats)
+            if self.filter(id=showtime_id, **current).update(occupancy=seatmap.encode(freed, capacity)):
+                return True
+        return False
+
+    def with_seats_sold(self):
+        """
+        Annotate the seats sold from the Ticket ledger, summed in one grouped query over the
+        (showtime, num_seats) index, and the seats held from the SeatHold table
+
+        :return: queryset annotated with seats_sold and seats_held
+        """
+        return self.annotate(seats_sold=Coalesce(Sum('ticket__num_seats'), 0),
+                             seats_held=Coalesce(Subquery(seats_held()), 0))
+
+    def reconcile_available(self):
+        """
+        Recompute the available seats of these showtimes from the tickets sold and the seats held, in a
+        single UPDATE. The available column is only a rollup of the Ticket ledger (and of the holds not given
+        back yet) kept for the conditional seat updates, this brings it back in line with the ledger.
+
+        :return: number of showtimes updated
+        """
+        sold = Ticket.objects.filter(showtime=OuterRef('pk')).order_by().values('showtime') \
+            .annotate(seats=Sum('num_seats')).values('seats')
+        capacity = Room.objects.filter(id=OuterRef('room_id')).values('capacity')
+        return self.update(available=Subquery(capacity) - Coalesce(Subquery(sold), 0)
+                           - Coalesce(Subquery(seats_held()), 0))
+
+    def lock(self, showtime_ids):
+        """
+        Lock showtime rows with SELECT ... FOR UPDATE in id order, where the backend supports it, so
+        concurrent changes to the same showtimes queue up instead of deadlocking. Must run inside a
+        transaction.
+
+        :param showtime_ids: ids of the showtimes
+        """
+        if connection.features.has_select_for_update:
+            list(self.filter(id__in=showtime_ids).order_by('id').select_for_update().values_list('id', flat=True))
+
+
+# optional Postgres constraint rejecting overlapping showtimes in a room, see the showtime_overlap_constraint
+# command
+OVERLAP_CONSTRAINT = 'showtime_room_no_overlap'
+
+
+def violates_overlap_constraint(error):
+    """
+    :param IntegrityError error: error raised saving a showtime
+    :return: whether it is OVERLAP_CONSTRAINT rejecting the showtime (an exclusion_violation on it)
+    """
+    cause = error.__cause__
+    return getattr(cause, 'pgcode', None) == '23P01' and \
+        getattr(getattr(cause, 'diag', None), 'constraint_name', None) == OVERLAP_CONSTRAINT
+
+
 class Showtime(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     available = models.IntegerField()
-    start_date = models.DateTimeField(default=dt.datetime.now())
+    start_date = models.DateTimeField(default=timezone.now)
     end_date = models.DateTimeField()
+    business_day = models.DateField(editable=False, help_text='day the showtime counts toward, see business_day()')
+    seat_counter = models.BooleanField(default=False,
+                                       help_text='sell from a write-behind counter in the cache, see seat_counters')
+    occupancy = models.BinaryField(null=True, editable=False, help_text='bitmap of taken seats, see seatmap')
+    # not touched by the seat sales, which update the row with a queryset update
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ShowtimeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'start_date'], name='showtime_room_start_idx'),
+            models.Index(fields=['room', 'end_date'], name='showtime_room_end_idx'),
+            models.Index(fields=['start_date', 'id'], name='showtime_start_id_idx'),
+            models.Index(fields=['movie', 'start_date'], name='showtime_movie_start_idx'),
+            models.Index(fields=['business_day', 'room'], name='showtime_day_room_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.room.name} {self.movie.title} {self.start_date}"
+        return showtime_label(self.room.name, self.movie.title, self.start_date, self.room.time_zone)
+
+    def save(self, *args, **kwargs):
+        self.business_day = business_day(self.start_date, self.room.time_zone)
+        super().save(*args, **kwargs)
 
 
 class Ticket(models.Model):
     showtime = models.ForeignKey(Showtime, on_delete=models.CASCADE)
     num_seats = models.IntegerField(verbose_name="Number of seats", default=1)
+    seats = models.TextField(blank=True, default='', help_text='comma separated seat labels, like "C7,C8"')
+
+    class Meta:
+        indexes = [
+            # the ledger: seats sold per showtime are summed from this index alone
+            models.Index(fields=['showtime', 'num_seats'], name='ticket_showtime_seats_idx'),
+        ]
 
     def __str__(self):
         return f"{self.showtime.movie.title} {self.showtime.room.name} {self.showtime.start_date} {self.num_seats}"
 
 
+def seats_held():
+    """
+    :return: subquery of the seats held for the outer showtime, summed over the (showtime, num_seats) index
+    """
+    return SeatHold.objects.filter(showtime=OuterRef('pk')).order_by().values('showtime') \
+        .annotate(seats=Sum('num_seats')).values('seats')
+
+
+class SeatHoldQuerySet(models.QuerySet):
+    def expired(self, now=None):
+        """
+        :param datetime now: defaults to the current time
+        :return: the holds expired at now, oldest first, read from the expiry index
+        """
+        return self.filter(expires_at__lte=now or timezone.now()).order_by('expires_at', 'id')
+
+
+class SeatHold(models.Model):
+    """
+    Seats taken from a showtime for a customer while they pay: confirmed into a ticket before expires_at,
+    or given back once it passed. See ticket_office.holds.
+    """
+    showtime = models.ForeignKey(Showtime, on_delete=models.CASCADE)
+    num_seats = models.IntegerField(verbose_name="Number of seats", default=1)
+    seats = models.TextField(blank=True, default='', help_text='comma separated seat labels, like "C7,C8"')
+    expires_at = models.DateTimeField()
+
+    objects = SeatHoldQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the sweeper reads the expired holds, oldest first, from this index alone
+            models.Index(fields=['expires_at', 'id'], name='seat_hold_expiry_idx'),
+            models.Index(fields=['showtime', 'num_seats'], name='seat_hold_showtime_seats_idx'),
+        ]
 
+    def __str__(self):
+        return f"{self.showtime_id} {self.num_seats} until {self.expires_at}"
+
+
+class PlayingSnapshot(models.Model):
+    """
+    Precomputed "now playing" listing: the showtimes of one room or movie on one day, flattened to JSON
+    so the playing views never touch Room, Movie or Showtime. Kept up to date by ticket_office.snapshots.
+    """
+    ROOM = 'room'
+    MOVIE = 'movie'
+    KIND_CHOICES = [(ROOM, 'Room'), (MOVIE, 'Movie')]
+
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    day = models.DateField()
+    name = models.CharField(max_length=200)
+    size = models.IntegerField(help_text="room's capacity or movie's duration")
+    showtimes = models.TextField(help_text='JSON list of [start date, showtime label] pairs')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id', 'day'], name='playing_snapshot_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} {self.day}"
+
+
+class DailyOccupancy(models.Model):
+    """
+    Showtimes, seats on sale and seats sold of one movie in one room on one closed business day: the nightly
+    rollup the analytics read instead of the showtimes and tickets of that day. See ticket_office.analytics.
+    """
+    business_day = models.DateField()
+    room = models.ForeignKey(Room, on_delete=models.CASCADE)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    showtimes = models.IntegerField()
+    capacity = models.IntegerField(help_text='seats on sale, the capacity of the room summed over the showtimes')
+    seats_sold = models.IntegerField()
+    tickets = models.IntegerField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['business_day', 'room', 'movie'], name='daily_occupancy_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.business_day} {self.room_id} {self.movie_id}"
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+    def sweep(self, now=None):
+        """
+        Delete every expired key in a single statement
+
+        :param datetime now: defaults to the current time
+        :return: number of keys deleted
+        """
+        deleted, _ = self.filter(expires_at__lte=now or timezone.now()).delete()
+        return deleted
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response of a ticket purchase sent with an Idempotency-Key header, replayed to the retries of that
+    request until it expires. See ticket_office.idempotency.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    request_hash = models.CharField(max_length=64, help_text='sha256 of the request body')
+    status_code = models.PositiveSmallIntegerField()
+    response = models.TextField(help_text='JSON response body')
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = IdempotencyKeyQuerySet.as_manager()
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,92 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward keyset (seek) pagination. The cursor holds the ordering values of the last row of the page,
+    and the next page is read with a WHERE (a, b) > (last_a, last_b) condition served straight from the
+    index, so deep pages cost the same as the first one, unlike OFFSET.
+
+    Ordering comes from the view's `ordering` attribute, ascending fields ending in a unique one
+    (normally id), defaulting to ('id',).
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = ('id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = tuple(getattr(view, 'ordering', None) or self.ordering)
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def after(self, position):
+        """
+        Row-value comparison (a, b, c) > (x, y, z), spelled out as
+        a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+
+        :param list position: ordering values of the last row of the previous page
+        :return: Q object
+        """
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            equal = {name: value for name, value in zip(self.ordering[:index], position)}
+            condition |= Q(**equal, **{'{}__gt'.format(field): position[index]})
+        return condition
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            values = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.ordering, values)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row):
+        values = [row[field] if isinstance(row, dict) else getattr(row, field) for field in self.ordering]
+        encoded = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+        return urlsafe_b64encode(encoded.encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,119 @@
+"""
+Movie title search, by whole words or as you type (prefix mode: the last word may be unfinished).
+
+On SQLite the titles are indexed in an FTS5 table, ticket_office_movie_fts, with prefix indexes for the
+autocomplete; it is kept in sync by the Movie save and delete signals, and rebuilt by rebuild() after bulk
+writes. On Postgres a GIN index on to_tsvector('simple', title) answers both modes, kept by the database
+itself. Elsewhere, or on an SQLite built without FTS5, the titles are scanned with icontains.
+"""
+import functools
+import re
+
+from django.db import connection
+
+from ticket_office.models import Movie
+
+FTS_TABLE = 'ticket_office_movie_fts'
+POSTGRES_INDEX = 'movie_title_search_idx'
+
+FULL_TEXT, PREFIX = 'full_text', 'prefix'
+MODES = (FULL_TEXT, PREFIX)
+
+
+@functools.lru_cache(maxsize=None)
+def sqlite_fts5():
+    """
+    :return: whether the SQLite library has FTS5 compiled in
+    """
+    import sqlite3
+    with sqlite3.connect(':memory:') as probe:
+        return ('ENABLE_FTS5',) in probe.execute('PRAGMA compile_options').fetchall()
+
+
+def backend(db_connection=connection):
+    """
+    :return: 'fts5', 'postgres' or None when the titles are scanned
+    """
+    if db_connection.vendor == 'sqlite' and sqlite_fts5():
+        return 'fts5'
+    if db_connection.vendor == 'postgresql':
+        return 'postgres'
+    return None
+
+
+def terms(query):
+    """
+    :param str query: what was typed
+    :return: list of the words in it, lowercase
+    """
+    return re.findall(r'\w+', query.lower())
+
+
+def search(query, mode=FULL_TEXT, limit=20):
+    """
+    Find movies by title, best matches first
+
+    :param str query: what was typed
+    :param str mode: FULL_TEXT to match whole words, PREFIX to also match titles where the last word
+        only starts with it
+    :param int limit: maximum number of movies
+    :return: list of movie ids
+    """
+    words = terms(query)
+    if not words:
+        return []
+    kind = backend()
+
+    if kind == 'fts5':
+        match = ' '.join('"{}"'.format(word) for word in words) + ('*' if mode == PREFIX else '')
+        sql = 'SELECT rowid FROM {} WHERE {} MATCH %s ORDER BY rank LIMIT %s'.format(FTS_TABLE, FTS_TABLE)
+        params = [match, limit]
+    elif kind == 'postgres':
+        tsquery = ' & '.join(words) + (':*' if mode == PREFIX else '')
+        sql = "SELECT id FROM ticket_office_movie WHERE to_tsvector('simple', title) @@ to_tsquery('simple', %s) " \
+              "ORDER BY ts_rank(to_tsvector('simple', title), to_tsquery('simple', %s)) DESC, id LIMIT %s"
+        params = [tsquery, tsquery, limit]
+    else:
+        movies = Movie.objects.all()
+        for word in words:
+            movies = movies.filter(title__icontains=word)
+        return list(movies.order_by('title', 'id').values_list('id', flat=True)[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def index(movie_id, title):
+    """
+    Add or replace a title in the FTS5 table, when there is one
+    """
+    if backend() != 'fts5':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [movie_id])
+        cursor.execute('INSERT INTO {}(rowid, title) VALUES (%s, %s)'.format(FTS_TABLE), [movie_id, title])
+
+
+def unindex(movie_id):
+    """
+    Remove a title from the FTS5 table, when there is one
+    """
+    if backend() != 'fts5':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [movie_id])
+
+
+def rebuild(db_connection=connection):
+    """
+    Reindex every title in the FTS5 table, after writes that send no signal (bulk_create, update)
+
+    :return: number of titles indexed, None when there is no FTS5 table
+    """
+    if backend(db_connection) != 'fts5':
+        return None
+    with db_connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+        cursor.execute('INSERT INTO {}(rowid, title) SELECT id, title FROM ticket_office_movie'.format(FTS_TABLE))
+        return cursor.rowcount
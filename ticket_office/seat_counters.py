@@ -0,0 +1,176 @@
+"""
+Write-behind seat counters for hot showtimes.
+
+A showtime with seat_counter set sells from a counter in the cache instead of its available column: a sale
+is an atomic cache decr plus the ticket insert, so sales of a premiere no longer queue up on the showtime
+row. The column falls behind and is brought back in line from the Ticket table by flush() (the
+seat_counters command, run periodically). The Ticket table stays the source of truth: after a crash or a
+lost cache the counters are rebuilt from it with recover().
+
+Counters need a cache shared by every worker process, with an atomic incr/decr and enough room to never
+evict them: memcached or redis, enable() refuses the local memory, file and database caches. Turn a
+counter on before the sales of a showtime open, and recover while sales are paused, so that no sale is
+in flight while a counter is computed. Only showtimes without a seat layout can use one: picking seats
+needs the occupancy bitmap of the row.
+"""
+import logging
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from ticket_office.caching import bump_generation
+from ticket_office.models import Showtime
+
+logger = logging.getLogger('ticket_office.seat_counters')
+
+# caches a counter can't live in: kept per process (local memory), with an incr/decr reading then writing the
+# value (files, database) so that two sales can take the same seat, or not kept at all
+UNSHARED_BACKENDS = (LocMemCache, FileBasedCache, DatabaseCache, DummyCache)
+
+
+def counter_key(showtime_id):
+    return 'ticket_office:seat_counter:{}'.format(showtime_id)
+
+
+def unsold_seats(showtime_ids):
+    """
+    :param showtime_ids: ids of the showtimes
+    :return: dict of seats left per showtime id, computed from the tickets sold and the seats held
+    """
+    showtimes = Showtime.objects.filter(id__in=showtime_ids).with_seats_sold()
+    return {showtime_id: capacity - sold - held for showtime_id, capacity, sold, held
+            in showtimes.values_list('id', 'room__capacity', 'seats_sold', 'seats_held')}
+
+
+def load(showtime_ids, overwrite=False):
+    """
+    Set the counters of these showtimes from the Ticket table
+
+    :param showtime_ids: ids of the showtimes
+    :param bool overwrite: replace live counters too, only safe while no sale is in flight
+    """
+    for showtime_id, seats in unsold_seats(showtime_ids).items():
+        if overwrite:
+            cache.set(counter_key(showtime_id), seats, None)
+        else:
+            cache.add(counter_key(showtime_id), seats, None)
+
+
+def take(showtime_id, seats):
+    """
+    Take seats from a showtime's counter. Give them back with give_back() if the sale doesn't commit
+
+    :param int showtime_id: id of the showtime
+    :param int seats: number of seats to take
+    :return: 'reserved' or 'sold_out'
+    """
+    key = counter_key(showtime_id)
+    try:
+        remaining = cache.decr(key, seats)
+    except ValueError:
+        logger.warning('Seat counter of showtime %s missing, rebuilt from the tickets sold', showtime_id)
+        load([showtime_id])
+        remaining = cache.decr(key, seats)
+    if remaining < 0:
+        # undo; a sale meanwhile may have seen the dip and been turned away, never the other way round
+        cache.incr(key, seats)
+        return 'sold_out'
+    return 'reserved'
+
+
+def give_back(taken):
+    """
+    :param dict taken: seats to return per showtime id
+    """
+    for showtime_id, seats in taken.items():
+        try:
+            cache.incr(counter_key(showtime_id), seats)
+        except ValueError:
+            pass  # lost with the cache, load() rebuilds it from the tickets
+
+
+def take_many(demand):
+    """
+    Take the seats of several showtimes from their counters, all of them or none
+
+    :param dict demand: seats to take per showtime id
+    :return: tuple of (dict of seats taken per showtime id, set of the sold out showtime ids). Nothing is
+        taken when any of them is sold out
+    """
+    taken, sold_out = {}, set()
+    for showtime_id, seats in sorted(demand.items()):
+        if take(showtime_id, seats) == 'reserved':
+            taken[showtime_id] = seats
+        else:
+            sold_out.add(showtime_id)
+    if sold_out:
+        give_back(taken)
+        taken = {}
+    return taken, sold_out
+
+
+def enable(showtime_ids, single_process=False):
+    """
+    Sell these showtimes from counters, starting from their current availability
+
+    :param showtime_ids: ids of the showtimes
+    :param bool single_process: the sales all come from this process, whose local memory cache will do
+    :return: number of showtimes switched
+    """
+    backend = caches['default']
+    if isinstance(backend, UNSHARED_BACKENDS) and not (single_process and isinstance(backend, LocMemCache)):
+        raise ValueError('Seat counters need a cache shared by every process with an atomic decrement, like '
+                         'memcached (CINEMA_MEMCACHED), not {}'.format(type(backend).__name__))
+    showtimes = Showtime.objects.filter(id__in=showtime_ids)
+    if showtimes.filter(room__seat_layout__isnull=False).exists():
+        raise ValueError('Showtimes of rooms with a seat layout cannot use a seat counter')
+    with transaction.atomic():
+        count = showtimes.update(seat_counter=True)
+        showtimes.reconcile_available()
+        load(showtime_ids, overwrite=True)
+    return count
+
+
+def disable(showtime_ids):
+    """
+    Sell these showtimes from their available column again, brought up to date first
+
+    :param showtime_ids: ids of the showtimes
+    :return: number of showtimes switched
+    """
+    showtimes = Showtime.objects.filter(id__in=showtime_ids, seat_counter=True)
+    with transaction.atomic():
+        showtimes.reconcile_available()
+        count = showtimes.update(seat_counter=False)
+    if count:
+        bump_generation(Showtime)
+    cache.delete_many([counter_key(showtime_id) for showtime_id in showtime_ids])
+    return count
+
+
+def flush():
+    """
+    Write the availability of every showtime sold from a counter back to its available column
+
+    :return: number of showtimes updated
+    """
+    count = Showtime.objects.filter(seat_counter=True).reconcile_available()
+    if count:
+        # the queryset update sends no signal, invalidate the cached showtimes by hand
+        bump_generation(Showtime)
+    return count
+
+
+def recover():
+    """
+    Rebuild every counter from the Ticket table, after a crash or a cache flush
+
+    :return: number of counters rebuilt
+    """
+    showtime_ids = list(Showtime.objects.filter(seat_counter=True).values_list('id', flat=True))
+    load(showtime_ids, overwrite=True)
+    return len(showtime_ids)
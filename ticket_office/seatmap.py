@@ -0,0 +1,137 @@
+"""
+Seat occupancy bitmaps.
+
+Seats of a room are numbered row by row: seat i is in row i // seats_per_row, column i % seats_per_row,
+and is taken when bit i of the showtime's occupancy is set. The bitmap is stored little-endian in a
+BinaryField and handled as a Python int, so finding and claiming a block of seats is a handful of
+whole-bitmap operations instead of a loop over seats.
+"""
+import re
+
+LABEL = re.compile(r'^([A-Z]+)(\d+)$')
+
+
+def decode(occupancy):
+    """
+    :param bytes occupancy: stored bitmap, None for a showtime nobody bought seats for yet
+    :return: int with a bit set per taken seat
+    """
+    return int.from_bytes(occupancy or b'', 'little')
+
+
+def encode(taken, capacity):
+    """
+    :param int taken: bit set per taken seat
+    :param int capacity: number of seats in the room
+    :return: bytes to store
+    """
+    return taken.to_bytes((capacity + 7) // 8, 'little')
+
+
+def row_label(row):
+    """
+    Spreadsheet style row names: A..Z, AA, AB...
+    """
+    label = ''
+    row += 1
+    while row:
+        row, remainder = divmod(row - 1, 26)
+        label = chr(ord('A') + remainder) + label
+    return label
+
+
+def label(seat, seats_per_row):
+    row, column = divmod(seat, seats_per_row)
+    return '{}{}'.format(row_label(row), column + 1)
+
+
+def parse(seat_label, rows, seats_per_row):
+    """
+    :param str seat_label: seat name like "C7"
+    :return: seat number, None if there is no such seat in the layout
+    """
+    match = LABEL.match(seat_label.strip().upper())
+    if not match:
+        return None
+    row = 0
+    for letter in match.group(1):
+        row = row * 26 + ord(letter) - ord('A') + 1
+    row, column = row - 1, int(match.group(2)) - 1
+    if row >= rows or not 0 <= column < seats_per_row:
+        return None
+    return row * seats_per_row + column
+
+
+def mask(seats):
+    """
+    :param seats: seat numbers
+    :return: int with their bits set
+    """
+    bits = 0
+    for seat in seats:
+        bits |= 1 << seat
+    return bits
+
+
+def seat_numbers(bits):
+    """
+    :param int bits: bitmap
+    :return: list of the seat numbers set in it, in order
+    """
+    numbers = []
+    while bits:
+        lowest = bits & -bits
+        numbers.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return numbers
+
+
+def find_block(taken, rows, seats_per_row, count):
+    """
+    First block of count adjacent free seats in a row
+
+    :return: bitmap of the block, None when no row has one
+    """
+    if not 0 < count <= seats_per_row:
+        return None
+    capacity = rows * seats_per_row
+    starts = ~taken & ((1 << capacity) - 1)
+    # after this loop bit i survives only when seats i .. i + count - 1 are all free
+    length = 1
+    while length < count:
+        step = min(length, count - length)
+        starts &= starts >> step
+        length += step
+    # and the block must not wrap into the next row: keep the first seats_per_row - count + 1 columns,
+    # the pattern repeated for every row with a single multiplication
+    row_starts = (1 << (seats_per_row - count + 1)) - 1
+    starts &= row_starts * (((1 << capacity) - 1) // ((1 << seats_per_row) - 1))
+    if not starts:
+        return None
+    return ((1 << count) - 1) << ((starts & -starts).bit_length() - 1)
+
+
+def first_free(taken, capacity, count):
+    """
+    The count lowest free seats, wherever they are
+
+    :return: bitmap of the seats, None when there are not that many free
+    """
+    free = ~taken & ((1 << capacity) - 1)
+    claim = 0
+    for _ in range(count):
+        if not free:
+            return None
+        lowest = free & -free
+        claim |= lowest
+        free ^= lowest
+    return claim
+
+
+def render(taken, rows, seats_per_row):
+    """
+    :return: one string per row, '.' for a free seat and 'X' for a taken one
+    """
+    row_bits = (1 << seats_per_row) - 1
+    return [format((taken >> (row * seats_per_row)) & row_bits, '0{}b'.format(seats_per_row))[::-1]
+            .replace('0', '.').replace('1', 'X') for row in range(rows)]
@@ -1,28 +1,35 @@
 import datetime as dt
+from operator import itemgetter
+
+from django.db import IntegrityError, connection, transaction
 from django.utils import timezone
 
-from ticket_office.models import Room, Movie, Ticket, Showtime
+from ticket_office import seatmap, snapshots
+from ticket_office.caching import bump_generation
+from ticket_office.models import (
+    Room, Movie, SeatHold, SeatLayout, Ticket, Showtime, business_day, showtime_label, violates_overlap_constraint,
+)
 from rest_framework import serializers
 
 
 class RoomSerializer(serializers.ModelSerializer):
     class Meta:
         model = Room
-        fields = '__all__'
+        exclude = ['updated_at']
         extra_kwargs = {'name': {'required': True}, 'capacity': {'required': True}}
 
 
 class MovieSerializer(serializers.ModelSerializer):
     class Meta:
         model = Movie
-        fields = '__all__'
+        exclude = ['updated_at']
         extra_kwargs = {'title': {'required': True}, 'duration': {'required': True}}
 
 
 class ShowtimeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Showtime
-        fields = ['id', 'room', 'movie', 'start_date']
+        fields = ['id', 'room', 'movie', 'start_date', 'business_day']
         extra_kwargs = {'room': {'required': True}, 'movie': {'required': True}, 'start_date': {'required': True}}
 
     def validate(self, data):
@@ -32,24 +39,51 @@ class ShowtimeSerializer(serializers.ModelSerializer):
         :rtype dict data: dictionary with the data sent to create new showtime
         :return: dictionary of validated data
         """
-        start = data.get('start_date')
+        start = data.get('start_date', getattr(self.instance, 'start_date', None))
+        room = data.get('room', getattr(self.instance, 'room', None))
+        movie = data.get('movie', getattr(self.instance, 'movie', None))
 
         if start < timezone.now():
             raise serializers.ValidationError('Start Date must be a future time.')
 
-        movie = Movie.objects.get(id=data['movie'].id)
-        room = Room.objects.get(id=data['room'].id)
         end = start + dt.timedelta(minutes=movie.duration)
-        overlap_start = Showtime.objects.filter(room=room.id, start_date__gte=start, start_date__lte=end).count()
-        overlap_end = Showtime.objects.filter(room=room.id, end_date__gte=start, end_date__lte=end).count()
+        overlapping = Showtime.objects.overlapping(room, start, end)
+        if self.instance is not None:
+            overlapping = overlapping.exclude(id=self.instance.id)
 
-        if overlap_start > 0 or overlap_end > 0:
+        if overlapping.exists():
             raise serializers.ValidationError("There is a showtime overlapped")
 
         data['end_date'] = end  # set up the end time to the show
-        data['available'] = room.capacity  # initialize availability with the room's size
+        if self.instance is None:
+            data['available'] = room.capacity  # initialize availability with the room's size
         return data
 
+    def save(self, **kwargs):
+        """
+        Save the showtime, turning a rejection from the optional database exclusion constraint (see the
+        showtime_overlap_constraint command) into the usual validation error: the constraint is hit when a
+        concurrent request scheduled an overlapping showtime after validate() ran. A showtime moved to another
+        room keeps the seats sold and held: its availability is recomputed from the ledger against the new
+        room's capacity
+
+        :param kwargs:
+        :return: saved showtime
+        """
+        moved = self.instance is not None and 'room' in self.validated_data \
+            and self.validated_data['room'].id != self.instance.room_id
+        try:
+            with transaction.atomic():
+                showtime = super(ShowtimeSerializer, self).save(**kwargs)
+                if moved:
+                    Showtime.objects.filter(id=showtime.id).reconcile_available()
+                    showtime.refresh_from_db(fields=['available'])
+                return showtime
+        except IntegrityError as error:
+            if not violates_overlap_constraint(error):
+                raise
+            raise serializers.ValidationError("There is a showtime overlapped")
+
     def to_representation(self, instance):
         """
         Method to get the movie and room name in the list, instead of getting the ids
@@ -63,7 +97,194 @@ class ShowtimeSerializer(serializers.ModelSerializer):
         return rep
 
 
+class ValuesSerializer:
+    """
+    Read-only serializer for the list endpoints, working on values() rows instead of model instances.
+    ModelSerializer builds every row field by field from an instance, plus a query per related object; here
+    related names are joined in SQL and each row is turned into the response dict by a function compiled
+    once per serializer class. Subclasses mirror the output of their ModelSerializer exactly.
+
+    fields are (response key, values() lookup or tuple of lookups, formatter or None) triples in response
+    order; a formatter is called with the values of its lookups.
+    """
+    fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.row_to_dict = staticmethod(cls.compile())
+
+    @classmethod
+    def lookups(cls):
+        lookups = []
+        for _, lookup, _ in cls.fields:
+            lookups.extend((lookup,) if isinstance(lookup, str) else lookup)
+        return lookups
+
+    @classmethod
+    def compile(cls):
+        """
+        :return: function turning a values() row into the response dict
+        """
+        columns = []
+        for key, lookup, formatter in cls.fields:
+            if isinstance(lookup, str):
+                get = itemgetter(lookup)
+                columns.append((key, get if formatter is None else
+                                lambda row, get=get, formatter=formatter: formatter(get(row))))
+            else:
+                get = itemgetter(*lookup)
+                columns.append((key, lambda row, get=get, formatter=formatter: formatter(*get(row))))
+        return lambda row: {key: get(row) for key, get in columns}
+
+    @classmethod
+    def values(cls, queryset):
+        """
+        :param queryset: model queryset
+        :return: values() queryset reading just the columns the response needs
+        """
+        return queryset.values(*cls.lookups())
+
+    @classmethod
+    def to_representation(cls, rows):
+        """
+        :param rows: values() rows
+        :return: list of response dicts
+        """
+        return [cls.row_to_dict(row) for row in rows]
+
+
+class ShowtimeValuesSerializer(ValuesSerializer):
+    """
+    ShowtimeSerializer's list output
+    """
+    fields = (
+        ('id', 'id', None),
+        ('room', 'room__name', None),
+        ('movie', 'movie__title', None),
+        ('start_date', 'start_date', serializers.DateTimeField().to_representation),
+        ('business_day', 'business_day', serializers.DateField().to_representation),
+    )
+
+
+class ShowtimeBulkListSerializer(serializers.ListSerializer):
+    """
+    Validate and create a whole batch of showtimes with a fixed number of queries
+    """
+    def to_internal_value(self, data):
+        """
+        Resolve rooms and movies for the whole batch at once, then look for overlaps against the
+        database and inside the batch with one sorted sweep per room. Errors are reported per item,
+        in the same order as the request.
+
+        :param list data: showtimes sent to be scheduled
+        :return: list of validated showtimes
+        """
+        items = super(ShowtimeBulkListSerializer, self).to_internal_value(data)
+        errors = [{} for _ in items]
+        rooms = Room.objects.in_bulk({item['room'] for item in items})
+        movies = Movie.objects.in_bulk({item['movie'] for item in items})
+        now = timezone.now()
+
+        intervals = {}
+        for index, item in enumerate(items):
+            if item['room'] not in rooms:
+                errors[index]['room'] = ['Invalid pk "{}" - object does not exist.'.format(item['room'])]
+            if item['movie'] not in movies:
+                errors[index]['movie'] = ['Invalid pk "{}" - object does not exist.'.format(item['movie'])]
+            if item['start_date'] < now:
+                errors[index]['start_date'] = ['Start Date must be a future time.']
+            if errors[index]:
+                continue
+
+            item['room'] = rooms[item['room']]
+            item['movie'] = movies[item['movie']]
+            item['end_date'] = item['start_date'] + dt.timedelta(minutes=item['movie'].duration)
+            item['available'] = item['room'].capacity
+            item['business_day'] = business_day(item['start_date'], item['room'].time_zone)
+            intervals.setdefault(item['room'].id, []).append((item['start_date'], item['end_date'], index))
+
+        if intervals:
+            earliest = min(start for room in intervals.values() for start, _, _ in room)
+            latest = max(end for room in intervals.values() for _, end, _ in room)
+            existing = Showtime.objects.filter(room__in=intervals, start_date__lte=latest, end_date__gte=earliest)
+            for room_id, start, end in existing.values_list('room_id', 'start_date', 'end_date'):
+                intervals[room_id].append((start, end, None))
+
+        for room_intervals in intervals.values():
+            room_intervals.sort(key=lambda interval: interval[0])
+            # any interval starting before the furthest end seen so far overlaps an earlier one
+            reach, reach_index = None, None
+            for start, end, index in room_intervals:
+                if reach is not None and start <= reach and (index, reach_index) != (None, None):
+                    if index is None:
+                        errors[reach_index]['non_field_errors'] = ['There is a showtime overlapped']
+                    elif reach_index is None:
+                        errors[index]['non_field_errors'] = ['There is a showtime overlapped']
+                    else:
+                        errors[index]['non_field_errors'] = [
+                            'There is a showtime overlapped with item {} of this batch'.format(reach_index)]
+                if reach is None or end > reach:
+                    reach, reach_index = end, index
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def create(self, validated_data):
+        """
+        Insert the batch with bulk_create. A rejection from the optional database exclusion constraint, hit
+        when a concurrent request scheduled an overlapping showtime after the batch was validated, is turned
+        into the usual validation error, as in ShowtimeSerializer.save()
+
+        :param list validated_data: validated showtimes
+        :return: list of created showtimes
+        """
+        if not validated_data:
+            return []
+        try:
+            with transaction.atomic():
+                showtimes = Showtime.objects.bulk_create([Showtime(**item) for item in validated_data])
+                # bulk_create sends no post_save, refresh the playing listings and the cache by hand
+                keys = set()
+                for showtime in showtimes:
+                    keys |= snapshots.showtime_keys(showtime.room_id, showtime.movie_id, showtime.business_day)
+                snapshots.refresh(keys)
+        except IntegrityError as error:
+            if not violates_overlap_constraint(error):
+                raise
+            raise serializers.ValidationError("There is a showtime overlapped")
+        bump_generation(Showtime)
+        transaction.on_commit(lambda: bump_generation(Showtime))
+
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # the backend doesn't hand back the new ids, read them back by (room, start_date),
+            # which the overlap check made unique
+            created = Showtime.objects.filter(room__in={showtime.room_id for showtime in showtimes},
+                                              start_date__gte=min(showtime.start_date for showtime in showtimes),
+                                              start_date__lte=max(showtime.start_date for showtime in showtimes))
+            ids = {(room_id, start): pk for pk, room_id, start in created.values_list('id', 'room_id', 'start_date')}
+            for showtime in showtimes:
+                showtime.id = ids[(showtime.room_id, showtime.start_date)]
+        return showtimes
+
+
+class ShowtimeBulkSerializer(serializers.Serializer):
+    """
+    One showtime of a bulk scheduling request. Rooms and movies are plain ids here, resolved for the
+    whole batch by ShowtimeBulkListSerializer
+    """
+    room = serializers.IntegerField()
+    movie = serializers.IntegerField()
+    start_date = serializers.DateTimeField()
+
+    class Meta:
+        list_serializer_class = ShowtimeBulkListSerializer
+
+
 class TicketSerializer(serializers.ModelSerializer):
+    # the room's seat layout comes along, ticket sales need it to claim seats
+    showtime = serializers.PrimaryKeyRelatedField(queryset=Showtime.objects.select_related('room__seat_layout'))
+
     class Meta:
         model = Ticket
         fields = "__all__"
@@ -81,8 +302,45 @@ class TicketSerializer(serializers.ModelSerializer):
         except:
             raise serializers.ValidationError('Number of seats must be integer')
 
+        if int(seats) < 1:
+            raise serializers.ValidationError('Number of seats must be at least 1')
+
         return seats
 
+    def validate(self, data):
+        """
+        Check the seats picked by the customer, if any, exist in the room's layout and match the number
+        of seats. They are normalized to a "C7,C8" string.
+
+        :rtype dict data: dictionary with the data sent to sell a ticket
+        :return: dictionary of validated data
+        """
+        if self.instance is not None:
+            showtime = data.get('showtime', self.instance.showtime)
+            resized = showtime.id != self.instance.showtime_id or \
+                int(data.get('num_seats', self.instance.num_seats)) != self.instance.num_seats
+            if resized and (self.instance.seats or getattr(showtime.room, 'seat_layout', None) is not None):
+                raise serializers.ValidationError(
+                    {'num_seats': "Tickets with picked seats can't be moved or resized, sell a new one"})
+
+        seats = data.get('seats')
+        if not seats:
+            return data
+        if self.instance is not None:
+            raise serializers.ValidationError({'seats': "Seats of a sold ticket can't be changed"})
+
+        layout = getattr(data['showtime'].room, 'seat_layout', None)
+        if layout is None:
+            raise serializers.ValidationError({'seats': 'This showtime has no seat map'})
+        labels = [label.strip().upper() for label in seats.split(',')]
+        if any(seatmap.parse(label, layout.rows, layout.seats_per_row) is None for label in labels):
+            raise serializers.ValidationError({'seats': 'Unknown seat'})
+        if len(set(labels)) != len(labels) or len(labels) != int(data['num_seats']):
+            raise serializers.ValidationError({'seats': 'Pick one different seat per number of seats'})
+
+        data['seats'] = ','.join(labels)
+        return data
+
     def to_representation(self, instance):
         """
         Method to get the showtime information instead of getting the ids
@@ -91,11 +349,136 @@ class TicketSerializer(serializers.ModelSerializer):
         :return:
         """
         rep = super(TicketSerializer, self).to_representation(instance)
-        rep['showtime'] = f"{instance.showtime.room.name} {instance.showtime.movie.title} " \
-                          f"{instance.showtime.start_date}"
+        showtime = instance.showtime
+        rep['showtime'] = showtime_label(showtime.room.name, showtime.movie.title, showtime.start_date,
+                                         showtime.room.time_zone)
         return rep
 
 
+class SeatHoldSerializer(TicketSerializer):
+    """
+    Seats held for a customer while they pay, checked like the ones of a ticket sale
+    """
+    class Meta(TicketSerializer.Meta):
+        model = SeatHold
+        read_only_fields = ['expires_at']
+
+
+class TicketValuesSerializer(ValuesSerializer):
+    """
+    TicketSerializer's list output
+    """
+    fields = (
+        ('id', 'id', None),
+        ('showtime', ('showtime__room__name', 'showtime__movie__title', 'showtime__start_date',
+                      'showtime__room__time_zone'), showtime_label),
+        ('num_seats', 'num_seats', None),
+        ('seats', 'seats', None),
+    )
+
+
+class TicketBatchListSerializer(serializers.ListSerializer):
+    """
+    Validate and create the tickets of a batch purchase with a fixed number of queries
+    """
+    def to_internal_value(self, data):
+        """
+        Load every showtime of the batch, with its room's seat layout, in one query and check the seats
+        picked in each item. Errors are reported per item, in the same order as the request.
+
+        :param list data: tickets to buy
+        :return: list of validated tickets, showtimes resolved and seats as seat numbers (None when not picked)
+        """
+        items = super(TicketBatchListSerializer, self).to_internal_value(data)
+        if not items:
+            raise serializers.ValidationError('Send at least one ticket')
+        errors = [{} for _ in items]
+        showtimes = Showtime.objects.select_related('room__seat_layout', 'movie') \
+            .in_bulk({item['showtime'] for item in items})
+
+        for index, item in enumerate(items):
+            showtime = showtimes.get(item['showtime'])
+            if showtime is None:
+                errors[index]['showtime'] = ['Invalid pk "{}" - object does not exist.'.format(item['showtime'])]
+                continue
+            item['showtime'] = showtime
+            labels = item.get('seats')
+            if not labels:
+                item['seats'] = None
+                continue
+
+            layout = getattr(showtime.room, 'seat_layout', None)
+            if layout is None:
+                errors[index]['seats'] = ['This showtime has no seat map']
+                continue
+            labels = [label.strip().upper() for label in labels.split(',')]
+            item['seats'] = [seatmap.parse(label, layout.rows, layout.seats_per_row) for label in labels]
+            if None in item['seats']:
+                errors[index]['seats'] = ['Unknown seat']
+            elif len(set(labels)) != len(labels) or len(labels) != item['num_seats']:
+                errors[index]['seats'] = ['Pick one different seat per number of seats']
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def create(self, validated_data):
+        """
+        Insert the tickets with bulk_create. Call it inside the transaction that reserved their seats
+
+        :param list validated_data: validated tickets, seats as a "C7,C8" string
+        :return: list of created tickets
+        """
+        returns_ids = connection.features.can_return_rows_from_bulk_insert
+        latest = 0 if returns_ids else Ticket.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        tickets = Ticket.objects.bulk_create([Ticket(**item) for item in validated_data])
+        if not returns_ids:
+            # the backend doesn't hand back the new ids; the seat reservation holds the write lock,
+            # so the tickets got the ids right after the latest one, in order
+            ids = Ticket.objects.filter(id__gt=latest).order_by('id').values_list('id', flat=True)
+            for ticket, pk in zip(tickets, ids):
+                ticket.id = pk
+        # bulk_create sends no post_save, invalidate the cached payloads by hand
+        bump_generation(Ticket)
+        transaction.on_commit(lambda: bump_generation(Ticket))
+        return tickets
+
+
+class TicketBatchSerializer(serializers.Serializer):
+    """
+    One ticket of a batch purchase. Showtimes are plain ids here, resolved for the whole batch by
+    TicketBatchListSerializer
+    """
+    showtime = serializers.IntegerField()
+    num_seats = serializers.IntegerField(min_value=1)
+    seats = serializers.CharField(required=False, allow_blank=True)
+
+    class Meta:
+        list_serializer_class = TicketBatchListSerializer
+
+
+class SeatLayoutSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SeatLayout
+        fields = ['rows', 'seats_per_row']
+        extra_kwargs = {'rows': {'min_value': 1}, 'seats_per_row': {'min_value': 1}}
+
+    def validate(self, data):
+        """
+        Check the layout holds exactly the room's capacity and no seats were sold with the previous one
+
+        :rtype dict data: dictionary with the layout
+        :return: dictionary of validated data
+        """
+        room = self.context['room']
+        if data['rows'] * data['seats_per_row'] != room.capacity:
+            raise serializers.ValidationError('The layout must have as many seats as the room capacity ({})'
+                                              .format(room.capacity))
+        if Showtime.objects.filter(room=room, occupancy__isnull=False).exists():
+            raise serializers.ValidationError('Seats were already sold with the current layout')
+        return data
+
+
 class RoomSummarySerializer(serializers.ModelSerializer):
     """
     Serialize list of showtimes per room
@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from ticket_office import snapshots
+from ticket_office.caching import bump_generation
+from ticket_office.models import Movie, Room, Showtime, Ticket
+
+
+@receiver([post_save, post_delete], sender=Room)
+@receiver([post_save, post_delete], sender=Movie)
+@receiver([post_save, post_delete], sender=Showtime)
+@receiver([post_save, post_delete], sender=Ticket)
+def invalidate_cached_payloads(sender, **kwargs):
+    """
+    Invalidate cached payloads built from the changed model. Bumped again once the transaction commits,
+    so a reader that cached the old rows between the first bump and the commit is not left stale.
+    """
+    bump_generation(sender)
+    transaction.on_commit(lambda: bump_generation(sender))
+
+
+@receiver(post_save, sender=Movie)
+def index_movie_title(sender, instance, **kwargs):
+    # imported here, like in the search view, so workers only load it once titles change
+    from ticket_office import search
+    search.index(instance.id, instance.title)
+
+
+@receiver(post_delete, sender=Movie)
+def unindex_movie_title(sender, instance, **kwargs):
+    from ticket_office import search
+    search.unindex(instance.id)
+
+
+def stored_snapshot_keys(showtimes):
+    keys = set()
+    for room_id, movie_id, day in showtimes.values_list('room_id', 'movie_id', 'business_day'):
+        keys |= snapshots.showtime_keys(room_id, movie_id, day)
+    return keys
+
+
+@receiver(pre_save, sender=Showtime)
+def remember_snapshot_keys(sender, instance, **kwargs):
+    """
+    Keep the listing the showtime was in before the change, it has to be recomputed too if it moved
+    """
+    instance._previous_snapshot_keys = stored_snapshot_keys(Showtime.objects.filter(id=instance.id)) \
+        if instance.id else set()
+
+
+@receiver(post_save, sender=Showtime)
+def refresh_showtime_snapshots(sender, instance, **kwargs):
+    keys = stored_snapshot_keys(Showtime.objects.filter(id=instance.id))
+    snapshots.refresh(keys | getattr(instance, '_previous_snapshot_keys', set()))
+
+
+@receiver(post_delete, sender=Showtime)
+def refresh_deleted_showtime_snapshots(sender, instance, **kwargs):
+    snapshots.refresh(snapshots.showtime_keys(instance.room_id, instance.movie_id, instance.business_day))
+
+
+@receiver(post_delete, sender=Showtime)
+def touch_deleted_showtime_schedule(sender, instance, **kwargs):
+    """
+    A deleted showtime leaves no updated_at behind, move its room's and movie's instead so the listings'
+    Last-Modified moves forward (see ticket_office.conditional)
+    """
+    now = timezone.now()
+    Room.objects.filter(id=instance.room_id).update(updated_at=now)
+    Movie.objects.filter(id=instance.movie_id).update(updated_at=now)
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_save, sender=Movie)
+def refresh_renamed_snapshots(sender, instance, created, **kwargs):
+    """
+    Room names and movie titles are part of every listing they appear in. A room moved to another time zone
+    also moves its showtimes to other business days, and so to other listings
+    """
+    if not created:
+        field = 'room' if sender is Room else 'movie'
+        showtimes = Showtime.objects.filter(**{field: instance.id})
+        keys = stored_snapshot_keys(showtimes)
+        if sender is Room and showtimes.refresh_business_days():
+            keys |= stored_snapshot_keys(showtimes)
+        snapshots.refresh(keys)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Apply SQLITE_PRAGMAS to every new SQLite connection, on the raw connection so they stay out of the
+    recorded queries
+    """
+    if connection.vendor == 'sqlite':
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            connection.connection.execute('PRAGMA {} = {}'.format(name, value))
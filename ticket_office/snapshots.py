@@ -0,0 +1,144 @@
+"""
+Maintenance of the PlayingSnapshot table.
+
+A snapshot row is identified by a (kind, object_id, day) key, day being the business day of the showtimes
+in their room's time zone (see Showtime.business_day). Whenever showtimes change, the keys they
+touch are recomputed in a handful of queries with refresh(); rebuild() recreates the whole table.
+"""
+import datetime as dt
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ticket_office.models import PlayingSnapshot, Showtime, showtime_label
+
+ROOM, MOVIE = PlayingSnapshot.ROOM, PlayingSnapshot.MOVIE
+
+SHOWTIME_FIELDS = ('room_id', 'room__name', 'room__capacity', 'room__time_zone', 'movie_id', 'movie__title',
+                   'movie__duration', 'start_date', 'business_day')
+
+# UTC offsets in use range from -12:00 to +14:00
+EARLIEST_OFFSET, LATEST_OFFSET = dt.timedelta(hours=-12), dt.timedelta(hours=14)
+
+
+def showtime_keys(room_id, movie_id, day):
+    """
+    :return: the snapshot keys a showtime is listed under
+    """
+    return {(ROOM, room_id, day), (MOVIE, movie_id, day)}
+
+
+def window_days(start, end=None):
+    """
+    Business days a time window can reach, whatever the time zone of the rooms
+
+    :param datetime start: start of the window
+    :param datetime end: end of the window, None for no limit
+    :return: tuple of (first day, last day or None)
+    """
+    cutoff = dt.timedelta(hours=settings.BUSINESS_DAY_START_HOUR)
+
+    def day(moment, offset, default):
+        try:
+            return (timezone.localtime(moment, timezone.utc) + offset - cutoff).date()
+        except OverflowError:
+            return default
+
+    first = day(start, EARLIEST_OFFSET, dt.date.min)
+    return first, (day(end, LATEST_OFFSET, None) if end is not None else None)
+
+
+def build(showtimes, keys=None):
+    """
+    Group showtime rows into snapshot rows
+
+    :param showtimes: iterable of SHOWTIME_FIELDS tuples ordered by start date
+    :param set keys: only build these keys, every key found when None
+    :return: dict of key to snapshot row fields
+    """
+    groups = {}
+    for room_id, room_name, capacity, time_zone, movie_id, title, duration, start, day in showtimes:
+        entry = [start.isoformat(), showtime_label(room_name, title, start, time_zone)]
+        for kind, object_id, name, size in ((ROOM, room_id, room_name, capacity), (MOVIE, movie_id, title, duration)):
+            key = (kind, object_id, day)
+            if keys is not None and key not in keys:
+                continue
+            groups.setdefault(key, {'name': name, 'size': size, 'showtimes': []})['showtimes'].append(entry)
+    return groups
+
+
+def refresh(keys, showtime_model=Showtime, snapshot_model=PlayingSnapshot):
+    """
+    Recompute the given snapshot rows: one query for the showtimes, one for the current rows, then a
+    delete and a bulk insert
+
+    :param keys: iterable of (kind, object_id, day)
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    rooms = {object_id for kind, object_id, _ in keys if kind == ROOM}
+    movies = {object_id for kind, object_id, _ in keys if kind == MOVIE}
+    first = min(day for _, _, day in keys)
+    last = max(day for _, _, day in keys)
+    showtimes = showtime_model.objects.filter(Q(room__in=rooms) | Q(movie__in=movies),
+                                              business_day__gte=first, business_day__lte=last) \
+        .order_by('start_date', 'id').values_list(*SHOWTIME_FIELDS)
+    groups = build(showtimes, keys)
+
+    current = snapshot_model.objects.filter(Q(kind=ROOM, object_id__in=rooms) | Q(kind=MOVIE, object_id__in=movies),
+                                            day__gte=first, day__lte=last)
+    stale = [pk for pk, kind, object_id, day in current.values_list('id', 'kind', 'object_id', 'day')
+             if (kind, object_id, day) in keys]
+    with transaction.atomic():
+        snapshot_model.objects.filter(id__in=stale).delete()
+        snapshot_model.objects.bulk_create(rows(groups, snapshot_model))
+
+
+def rebuild(showtime_model=Showtime, snapshot_model=PlayingSnapshot, batch_size=1000):
+    """
+    Recreate the whole snapshot table from the showtimes
+
+    :return: number of snapshot rows written
+    """
+    showtimes = showtime_model.objects.order_by('start_date', 'id').values_list(*SHOWTIME_FIELDS)
+    groups = build(showtimes.iterator(chunk_size=batch_size))
+    with transaction.atomic():
+        snapshot_model.objects.all().delete()
+        snapshot_model.objects.bulk_create(rows(groups, snapshot_model))
+    return len(groups)
+
+
+def rows(groups, snapshot_model):
+    return [snapshot_model(kind=kind, object_id=object_id, day=day, name=group['name'], size=group['size'],
+                           showtimes=json.dumps(group['showtimes']))
+            for (kind, object_id, day), group in groups.items()]
+
+
+def playing(kind, object_ids, start, end=None):
+    """
+    Read the listing of some rooms or movies from their snapshot rows
+
+    :param str kind: 'room' or 'movie'
+    :param list object_ids: ids of the rooms or movies, in listing order
+    :param datetime start: only showtimes starting from this moment
+    :param datetime end: only showtimes starting up to this moment, no limit when None
+    :return: list of dicts with name, size and showtime labels, one per object with showtimes in the window
+    """
+    first, last = window_days(start, end)
+    snapshots = PlayingSnapshot.objects.filter(kind=kind, object_id__in=object_ids, day__gte=first)
+    if last is not None:
+        snapshots = snapshots.filter(day__lte=last)
+
+    listing = {}
+    for object_id, name, size, showtimes in snapshots.order_by('object_id', 'day') \
+            .values_list('object_id', 'name', 'size', 'showtimes'):
+        entry = listing.setdefault(object_id, {'name': name, 'size': size, 'showtimes': []})
+        for show_start, label in json.loads(showtimes):
+            show_start = dt.datetime.fromisoformat(show_start)
+            if show_start >= start and (end is None or show_start <= end):
+                entry['showtimes'].append(label)
+    return [listing[object_id] for object_id in object_ids if listing.get(object_id, {}).get('showtimes')]
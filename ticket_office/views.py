@@ -1,208 +1,796 @@
-from rest_framework import viewsets, generics, views
-from rest_framework.exceptions import ValidationError
+import base64
+import datetime as dt
+import math
+from collections import Counter, OrderedDict
+
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import mixins, status, viewsets, views
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound, ValidationError
 from rest_framework.response import Response
 
-from ticket_office.serializers import *
+# the modules of the sales and listings only: the feature views (analytics, exports, holds, search)
+# import theirs when first called, so a fresh worker doesn't load them before its first request
+from ticket_office import conditional, idempotency, metrics, seat_counters, seatmap, snapshots
+from ticket_office.caching import bump_generation, get_or_build, stats, versioned_key
+from ticket_office.models import Movie, PlayingSnapshot, Room, SeatHold, SeatLayout, Showtime, Ticket
+from ticket_office.pagination import KeysetPagination
+from ticket_office.serializers import (
+    MovieSerializer, MoviesPlayingSerializer, RoomSerializer, RoomsPlayingSerializer, SeatHoldSerializer,
+    SeatLayoutSerializer, ShowtimeBulkSerializer, ShowtimeSerializer, ShowtimeValuesSerializer, TicketBatchSerializer,
+    TicketSerializer, TicketValuesSerializer,
+)
 
 
-class RoomViewSet(viewsets.ModelViewSet):
+class ShowtimeBusy(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The showtime is busy with another sale, try again.'
+    default_code = 'showtime_busy'
+
+
+class HoldExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'This hold expired or was already confirmed or released, its seats are back on sale.'
+    default_code = 'hold_expired'
+
+
+def take_seats(showtime, num_seats, labels):
+    """
+    Take the seats of a ticket or a hold: from the seat counter, the available column or the seat map of the
+    showtime. Must run inside the transaction saving the ticket or hold; if it rolls back, give the seats
+    taken from a counter back.
+
+    :param Showtime showtime: showtime, with its room's seat layout loaded
+    :param int num_seats: number of seats to take
+    :param str labels: seats picked by the customer, like "C7,C8", None to pick them here
+    :return: tuple of (labels of the seats taken, dict of seats taken from a counter per showtime id)
+    """
+    layout = getattr(showtime.room, 'seat_layout', None)
+    counted = {}
+    if layout is None and showtime.seat_counter:
+        reservation = seat_counters.take(showtime.id, num_seats)
+        if reservation == 'reserved':
+            counted = {showtime.id: num_seats}
+        seats = ''
+    elif layout is None:
+        reservation = Showtime.objects.reserve(showtime.id, num_seats)
+        seats = ''
+    else:
+        chosen = [seatmap.parse(label, layout.rows, layout.seats_per_row)
+                  for label in labels.split(',')] if labels else None
+        reservation, claimed = Showtime.objects.claim_seats(showtime.id, layout, num_seats, chosen)
+        seats = ','.join(seatmap.label(seat, layout.seats_per_row) for seat in claimed)
+
+    if reservation == 'busy':
+        raise ShowtimeBusy()
+    if reservation == 'sold_out':
+        raise ValidationError({'num_seats': 'Not enough Availability'})
+    if reservation == 'taken':
+        raise ValidationError({'seats': 'Some of those seats are already taken'})
+    return seats, counted
+
+
+def export_output(request):
+    """
+    Output format of an export, chosen with ?output=ndjson (default) or ?output=csv
+
+    :param request:
+    :return: output format
+    """
+    from ticket_office import exports
+    output = request.query_params.get('output', 'ndjson')
+    if output not in exports.CONTENT_TYPES:
+        raise ValidationError({'output': 'Choose one of: {}.'.format(', '.join(exports.CONTENT_TYPES))})
+    return output
+
+
+class CachedReadMixin:
+    """
+    Read-through cache for list and retrieve. Entries are keyed by the generation of every model in
+    cache_models, which the model signals bump on any change, so a cached payload is never stale.
+    """
+    cache_models = ()
+    # anything else the listing depends on
+    cache_parts = ()
+
+    def list(self, request, *args, **kwargs):
+        key = versioned_key(self.cache_models, self.basename, 'list', request.get_full_path(), *self.cache_parts)
+        data, hit = get_or_build(key, lambda: super(CachedReadMixin, self).list(request, *args, **kwargs).data)
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        key = versioned_key(self.cache_models, self.basename, 'retrieve', lookup)
+        data, hit = get_or_build(key, lambda: super(CachedReadMixin, self).retrieve(request, *args, **kwargs).data)
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+
+class ValuesListMixin:
+    """
+    List through values_serializer_class, a ValuesSerializer reading values() rows, instead of building
+    a model instance and running the ModelSerializer for every row
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.values_serializer_class.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(self.values_serializer_class.to_representation(queryset))
+        return self.get_paginated_response(self.values_serializer_class.to_representation(page))
+
+
+class RoomViewSet(CachedReadMixin, viewsets.ModelViewSet):
     queryset = Room.objects.all()
     serializer_class = RoomSerializer
     lookup_field = 'id'
+    cache_models = (Room,)
 
-    def delete(self, request, *args, **kwargs):
+    @action(detail=True, methods=['get', 'put'])
+    def seat_layout(self, request, id=None):
         """
-        Delete a room by id
+        Read or set the seat layout of a room
 
         :param request:
-        :param args:
-        :param kwargs:
+        :param id: room id
         :return:
         """
-        room_id = request.data.get('id')
-        response = super().delete(request, *args, **kwargs)
-        if response.status_code == 204:
-            # Clearing cache to frees up space
-            from django.core.cache import cache
-            cache.delete('room_data_{}'.format(room_id))
-        return response
+        room = self.get_object()
+        layout = SeatLayout.objects.filter(room=room).first()
+        if request.method == 'GET':
+            if layout is None:
+                raise NotFound('This room has no seat layout.')
+            return Response(SeatLayoutSerializer(layout).data)
+
+        serializer = SeatLayoutSerializer(layout, data=request.data, context={'room': room})
+        serializer.is_valid(raise_exception=True)
+        serializer.save(room=room)
+        return Response(serializer.data)
+
+
+class MovieViewSet(CachedReadMixin, viewsets.ModelViewSet):
+    queryset = Movie.objects.all()
+    serializer_class = MovieSerializer
+    lookup_field = 'id'
+    cache_models = (Movie,)
 
-    def update(self, request, *args, **kwargs):
+    @action(detail=False)
+    def search(self, request):
         """
-        Update room's information loaded by id
+        Search the titles with ?q=, by whole words or with ?mode=prefix as the title is typed, best
+        matches first, the first ?limit= (20 by default). Answered from the title index, see
+        ticket_office.search
 
         :param request:
-        :param args:
-        :param kwargs:
         :return:
         """
-        response = super().update(request, *args, **kwargs)
-        if response.status_code == 200:
-            from django.core.cache import cache
-            room = response.data
-            cache.set('room_data_{}'.format(room['id']), {
-                'name': room['name'],
-                'capacity': room['capacity']
-            })
-        return response
+        from ticket_office import search
+        query = request.query_params.get('q', '')
+        if not search.terms(query):
+            raise ValidationError({'q': 'Enter a word to search for.'})
+        mode = request.query_params.get('mode', search.FULL_TEXT)
+        if mode not in search.MODES:
+            raise ValidationError({'mode': 'Choose one of: {}.'.format(', '.join(search.MODES))})
+        limit = min(query_number(request, 'limit', minimum=1) or 20, 100)
+
+        ids = search.search(query, mode, limit)
+        movies = Movie.objects.in_bulk(ids)
+        return Response(MovieSerializer([movies[movie_id] for movie_id in ids if movie_id in movies], many=True).data)
+
+
+class ShowtimeViewSet(CachedReadMixin, ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Showtime.objects.all().order_by('start_date', 'id')
+    serializer_class = ShowtimeSerializer
+    values_serializer_class = ShowtimeValuesSerializer
+    lookup_field = 'id'
+    ordering = ('start_date', 'id')
+    # seat sales leave the cached pages alone, like the conditional GETs, unless the listing filters on them
+    cache_models = (Showtime, Room, Movie)
 
+    def filter_queryset(self, queryset):
+        """
+        Filter the listing in SQL with the query parameters, each one narrowing an index range (see
+        Showtime.Meta.indexes): start and end (a date or a date and time), room and movie ids,
+        min_available seats, within_hours, showtimes starting from now to that many hours later, and day,
+        a business day, with city, the city of the room
 
-class MovieViewSet(viewsets.ModelViewSet):
-    queryset = Movie.objects.all()
-    serializer_class = MovieSerializer
-    lookup_field = 'id'
+        :param queryset:
+        :return: filtered queryset
+        """
+        if self.action != 'list':
+            return queryset
+        request = self.request
+        start, end, _ = self.window(request)
+        return queryset.scheduled(start=start, end=end, room=query_number(request, 'room', minimum=1),
+                                  movie=query_number(request, 'movie', minimum=1),
+                                  min_available=query_number(request, 'min_available'),
+                                  day=query_day(request, 'day'), city=request.query_params.get('city') or None)
+
+    def window(self, request):
+        """
+        Read the start/end filter, narrowed by within_hours to the hours from now
 
-    def delete(self, request, *args, **kwargs):
+        :param request:
+        :return: tuple of (start, end, whether the window moves with the clock), start and end may be None
+        """
+        start, end = query_moment(request, 'start'), query_moment(request, 'end')
+        within_hours = query_number(request, 'within_hours', kind=float)
+        if within_hours is None:
+            return start, end, False
+        now = timezone.now()
+        try:
+            horizon = now + dt.timedelta(hours=within_hours)
+        except OverflowError:
+            horizon = dt.datetime.max.replace(tzinfo=timezone.utc)
+        return (now if start is None else max(start, now)), (horizon if end is None else min(end, horizon)), True
+
+    def list(self, request, *args, **kwargs):
         """
-        Deletes a movie by id and frees up space in cache
+        List the showtimes, answering conditional requests with a 304 when nothing changed
 
         :param request:
         :param args:
         :param kwargs:
         :return:
         """
-        movie_id = request.data.get('id')
-        response = super().delete(request, *args, **kwargs)
-        if response.status_code == 204:
-            from django.core.cache import cache
-            cache.delete('movie_data_{}'.format(movie_id))
-        return response
+        start, end, moving = self.window(request)
+        # the cached page of a window moving with the clock is keyed by where the clock stands too
+        self.cache_parts = conditional.clock_version(start, end) if moving else ()
+        # seat sales only matter to the listing through min_available; they update showtime rows with a queryset
+        # update, which sends no signal, the ticket does
+        availability = None
+        if 'min_available' in request.query_params:
+            availability = self.filter_queryset(self.get_queryset())
+            self.cache_models = self.cache_models + (Ticket,)
+        return conditional.respond(request, lambda: super(ShowtimeViewSet, self).list(request, *args, **kwargs),
+                                   self.cache_parts, availability)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Schedule a batch of showtimes at once. The batch is validated as a whole (rooms, movies and
+        overlaps against the database and within the batch) and inserted all-or-nothing
+
+        :param request:
+        :return:
+        """
+        serializer = ShowtimeBulkSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        showtimes = serializer.save()
+        return Response(ShowtimeSerializer(showtimes, many=True).data, status=status.HTTP_201_CREATED)
 
-    def update(self, request, *args, **kwargs):
+    @action(detail=True)
+    def seats(self, request, id=None):
         """
-        Updates the information loaded from the movie and set that value in cache
+        Seat map of a showtime: the occupancy bitmap (base64, bit i set when seat i is taken, seats
+        numbered row by row) and the same drawn one row per string. Read in a single query.
+
+        :param request:
+        :param id: showtime id
+        :return:
+        """
+        row = Showtime.objects.filter(id=id).values_list(
+            'occupancy', 'available', 'room__seat_layout__rows', 'room__seat_layout__seats_per_row').first()
+        if row is None:
+            raise NotFound()
+        occupancy, available, rows, seats_per_row = row
+        if rows is None:
+            raise NotFound('This showtime has no seat map.')
+
+        taken = seatmap.decode(occupancy)
+        return Response({
+            'rows': rows,
+            'seats_per_row': seats_per_row,
+            'available': available,
+            'occupancy': base64.b64encode(seatmap.encode(taken, rows * seats_per_row)).decode('ascii'),
+            'map': seatmap.render(taken, rows, seats_per_row),
+        })
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        Stream every showtime as NDJSON or CSV
 
         :param request:
-        :param args:
-        :param kwargs:
         :return:
         """
-        response = super().update(request, *args, **kwargs)
-        if response.status_code == 200:
-            from django.core.cache import cache
-            movie = response.data
-            cache.set('movie_data_{}'.format(movie['id']), {
-                'name': movie['title'],
-                'capacity': movie['duration']
-            })
-        return response
+        from ticket_office import exports
+        output = export_output(request)
+        return exports.stream(['id', 'room', 'movie', 'start_date', 'business_day'],
+                              exports.showtime_rows(Showtime.objects.all()), output, 'showtimes')
 
 
-class ShowtimeViewSet(viewsets.ModelViewSet):
-    queryset = Showtime.objects.all().order_by('start_date')
-    serializer_class = ShowtimeSerializer
-    lookup_field = 'id'
+class TicketView(ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Ticket.objects.all()
+    serializer_class = TicketSerializer
+    values_serializer_class = TicketValuesSerializer
 
-    def delete(self, request, *args, **kwargs):
+    def create(self, request, *args, **kwargs):
         """
-        Delete a showtime by id. Frees up cache space
+        Method to sell a ticket. This will discount the number of seats sold from the availability in the showtime.
+        Retries sending the same Idempotency-Key header get the response of the first purchase back
 
         :param request:
         :param args:
         :param kwargs:
         :return:
         """
-        showtime_id = request.data.get('id')
-        response = super().delete(request, *args, **kwargs)
-        if response.status_code == 204:
-            from django.core.cache import cache
-            cache.delete('showtime_data_{}'.format(showtime_id))
-        return response
+        key = idempotency.request_key(request)
+        request_hash = idempotency.fingerprint(request.data) if key is not None else None
+        if key is not None:
+            replayed = idempotency.replay(key, request_hash)
+            if replayed is not None:
+                return replayed
+
+        try:
+            serializer = self.sell(request, key, request_hash)
+        except IntegrityError:
+            # a concurrent retry with the same key sold the ticket first, this sale was rolled back
+            replayed = idempotency.replay(key, request_hash) if key is not None else None
+            if replayed is None:
+                raise
+            return replayed
+
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def sell(self, request, key, request_hash):
+        """
+        Take the seats and create the ticket
 
-    def update(self, request, *args, **kwargs):
+        :param request:
+        :param str key: Idempotency-Key of the request, None when it has none
+        :param str request_hash: fingerprint of the request body
+        :return: serializer of the new ticket
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        counted = {}
+        try:
+            # the seat decrement, the ticket insert and the idempotency key commit together or not at all
+            with transaction.atomic():
+                seats, counted = take_seats(serializer.validated_data['showtime'],
+                                            serializer.validated_data['num_seats'],
+                                            serializer.validated_data.get('seats'))
+                serializer.save(seats=seats)
+
+                if key is not None:
+                    idempotency.remember(key, request_hash, status.HTTP_201_CREATED, serializer.data)
+        except Exception:
+            # the sale was rolled back, the seats taken from a counter go back too
+            seat_counters.give_back(counted)
+            raise
+        return serializer
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
         """
-        Update a showtime loaded by id and set up the information in cache
+        Buy tickets for several showtimes at once, all of them or none. The showtimes are locked in id
+        order, each takes its seats with one conditional update and the tickets are inserted with
+        bulk_create. Retries sending the same Idempotency-Key header get the first response back
 
         :param request:
-        :param args:
-        :param kwargs:
         :return:
         """
-        response = super().update(request, *args, **kwargs)
-        if response.status_code == 200:
-            from django.core.cache import cache
-            showtime = response.data
-            cache.set('showtime_data_{}'.format(showtime['id']), {
-                'room': showtime['room'],
-                'movie': showtime['movie'],
-                'start_date': showtime['start_date']
-            })
-        return response
+        key = idempotency.request_key(request)
+        request_hash = idempotency.fingerprint(request.data) if key is not None else None
+        if key is not None:
+            replayed = idempotency.replay(key, request_hash)
+            if replayed is not None:
+                return replayed
+
+        try:
+            data = self.sell_batch(request, key, request_hash)
+        except IntegrityError:
+            # a concurrent retry with the same key bought the tickets first, this batch was rolled back
+            replayed = idempotency.replay(key, request_hash) if key is not None else None
+            if replayed is None:
+                raise
+            return replayed
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def sell_batch(self, request, key, request_hash):
+        """
+        Take the seats of every ticket of the batch and create the tickets
 
+        :param request:
+        :param str key: Idempotency-Key of the request, None when it has none
+        :param str request_hash: fingerprint of the request body
+        :return: serialized tickets
+        """
+        serializer = TicketBatchSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        orders = serializer.validated_data
+
+        # showtimes sold from a write-behind counter take their seats there, the others from their row
+        demand = {}
+        for order in orders:
+            showtime = order['showtime']
+            if showtime.seat_counter and getattr(showtime.room, 'seat_layout', None) is None:
+                demand[showtime.id] = demand.get(showtime.id, 0) + order['num_seats']
+        counted, sold_out = seat_counters.take_many(demand)
+        try:
+            with transaction.atomic():
+                reservations = Showtime.objects.reserve_many(
+                    [(order['showtime'], order['num_seats'], order['seats']) for order in orders], counted=demand)
+                errors = [{} for _ in orders]
+                for index, (reservation, claimed) in enumerate(reservations):
+                    if reservation == 'busy':
+                        raise ShowtimeBusy()
+                    if reservation == 'sold_out' or orders[index]['showtime'].id in sold_out:
+                        errors[index]['num_seats'] = ['Not enough Availability']
+                    if reservation == 'taken':
+                        errors[index]['seats'] = ['Some of those seats are already taken']
+                    layout = getattr(orders[index]['showtime'].room, 'seat_layout', None)
+                    orders[index]['seats'] = ','.join(seatmap.label(seat, layout.seats_per_row)
+                                                      for seat in claimed) if layout else ''
+                if any(errors):
+                    raise ValidationError(errors)
+
+                data = TicketSerializer(serializer.save(), many=True).data
+                if key is not None:
+                    idempotency.remember(key, request_hash, status.HTTP_201_CREATED, data)
+        except Exception:
+            # the purchase was rolled back, the seats taken from counters go back too
+            seat_counters.give_back(counted)
+            raise
+        return data
+
+    def perform_update(self, serializer):
+        """
+        Save a changed ticket and derive the availability of its previous and new showtime from the ledger
 
-class TicketView(viewsets.ModelViewSet):
-    queryset = Ticket.objects.all()
-    serializer_class = TicketSerializer
+        :param serializer:
+        :return:
+        """
+        ticket = serializer.instance
+        showtime = serializer.validated_data.get('showtime', ticket.showtime)
+        delta = Counter({ticket.showtime_id: -ticket.num_seats})
+        delta[showtime.id] += int(serializer.validated_data.get('num_seats', ticket.num_seats))
+        self.change_ledger(serializer.save, delta)
+
+    def perform_destroy(self, instance):
+        """
+        Delete a ticket, freeing its seats in the seat map, and derive the availability of its showtime
+        from the ledger
+
+        :param instance:
+        :return:
+        """
+        layout = getattr(instance.showtime.room, 'seat_layout', None)
+
+        def delete():
+            showtime_id = instance.showtime_id
+            instance.delete()
+            if instance.seats and layout is not None:
+                seats = [seatmap.parse(label, layout.rows, layout.seats_per_row) for label in instance.seats.split(',')]
+                if not Showtime.objects.release_seats(showtime_id, layout, seats):
+                    raise ShowtimeBusy()
+
+        self.change_ledger(delete, {instance.showtime_id: -instance.num_seats})
+
+    def change_ledger(self, change, delta):
+        """
+        Change tickets and recompute the available seats of the showtimes involved from the Ticket ledger,
+        instead of adjusting them by hand, so the column cannot drift from the tickets sold
+
+        :param change: function writing the tickets, run in the transaction
+        :param dict delta: seats sold added, or removed when negative, per showtime id
+        :return: change's return value
+        """
+        delta = {showtime_id: seats for showtime_id, seats in delta.items() if seats}
+        counters = set(Showtime.objects.filter(id__in=delta, seat_counter=True).values_list('id', flat=True))
+        counted, sold_out = seat_counters.take_many(
+            {showtime_id: seats for showtime_id, seats in delta.items() if showtime_id in counters and seats > 0})
+        if sold_out:
+            raise ValidationError({'num_seats': 'Not enough Availability'})
+        try:
+            with transaction.atomic():
+                Showtime.objects.lock(delta)
+                result = change()
+                showtimes = Showtime.objects.filter(id__in=delta)
+                showtimes.reconcile_available()
+                if showtimes.filter(available__lt=0).exists():
+                    raise ValidationError({'num_seats': 'Not enough Availability'})
+        except Exception:
+            seat_counters.give_back(counted)
+            raise
+        seat_counters.give_back({showtime_id: -seats for showtime_id, seats in delta.items()
+                                 if showtime_id in counters and seats < 0})
+        return result
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        Stream every ticket as NDJSON or CSV
+
+        :param request:
+        :return:
+        """
+        from ticket_office import exports
+        output = export_output(request)
+        return exports.stream(['id', 'showtime', 'num_seats', 'seats'], exports.ticket_rows(Ticket.objects.all()),
+                              output, 'tickets')
+
+
+class SeatHoldViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
+                      viewsets.GenericViewSet):
+    queryset = SeatHold.objects.all()
+    serializer_class = SeatHoldSerializer
+    lookup_field = 'id'
 
     def create(self, request, *args, **kwargs):
         """
-        Method to sell a ticket. This will discount the number of seats sold from the availability in the showtime
+        Hold seats while the customer pays. They are taken from the showtime straight away and given back
+        by the sweep_seat_holds worker unless the hold is confirmed before expires_at
 
         :param request:
         :param args:
         :param kwargs:
         :return:
         """
-        num_tickets = int(request.data.get('num_seats'))
-        showtime = Showtime.objects.get(id=request.data.get('showtime'))
-        available = showtime.available
+        from ticket_office import holds
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        counted = {}
+        try:
+            with transaction.atomic():
+                seats, counted = take_seats(serializer.validated_data['showtime'],
+                                            serializer.validated_data['num_seats'],
+                                            serializer.validated_data.get('seats'))
+                serializer.save(seats=seats, expires_at=holds.expiry())
+                # the seats were taken with a queryset update, which sends no signal
+                bump_generation(Showtime)
+                transaction.on_commit(lambda: bump_generation(Showtime))
+        except Exception:
+            seat_counters.give_back(counted)
+            raise
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    @action(detail=True, methods=['post'])
+    def confirm(self, request, id=None):
+        """
+        Turn the hold into a ticket for its seats, 410 once it expired
 
-        if available - num_tickets >= 0:
-            showtime.available = available - num_tickets
-            showtime.save()
-        else:
-            raise ValidationError({'num_seats': 'Not enough Availability'})
+        :param request:
+        :param id: hold id
+        :return:
+        """
+        from ticket_office import holds
+        ticket = holds.confirm(id)
+        if ticket is None:
+            raise HoldExpired()
+        return Response(TicketSerializer(ticket).data, status=status.HTTP_201_CREATED)
+
+    def perform_destroy(self, instance):
+        """
+        Give the seats of the hold back straight away
+
+        :param instance:
+        :return:
+        """
+        from ticket_office import holds
+        holds.cancel(instance.id)
+
+
+def query_moment(request, param):
+    """
+    Read a query parameter holding a date or a date and time, a date meaning its midnight. Without a UTC
+    offset it is taken in the current time zone (TIME_ZONE)
+
+    :param request:
+    :param str param: name of the parameter
+    :return: aware datetime, None when the parameter is missing
+    """
+    value = request.query_params.get(param)
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = dt.datetime.combine(day, dt.time.min) if day is not None else None
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ValidationError({param: 'Enter a valid date or date and time.'})
+    return timezone.make_aware(moment, is_dst=False) if timezone.is_naive(moment) else moment
+
+
+def query_day(request, param):
+    """
+    Read a query parameter holding a date
+
+    :param request:
+    :param str param: name of the parameter
+    :return: date, None when the parameter is missing
+    """
+    value = request.query_params.get(param)
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({param: 'Enter a valid date.'})
+    return day
+
+
+def query_number(request, param, minimum=0, kind=int):
+    """
+    Read a numeric query parameter
 
-        return super().create(request, *args, **kwargs)
+    :param request:
+    :param str param: name of the parameter
+    :param minimum: smallest value accepted
+    :param kind: int or float
+    :return: number, None when the parameter is missing
+    """
+    value = request.query_params.get(param)
+    if not value:
+        return None
+    try:
+        number = kind(value)
+    except ValueError:
+        number = None
+    if number is None or not math.isfinite(number) or number < minimum:
+        raise ValidationError({param: 'Enter a number greater than or equal to {}.'.format(minimum)})
+    return number
+
+
+def playing_window(request):
+    """
+    Read the start/end filter of the playing listings. Both accept a date or a date and time; start
+    defaults to now and end to no limit
+
+    :param request:
+    :return: tuple of (start, end) datetimes, end may be None
+    """
+    return query_moment(request, 'start') or timezone.now(), query_moment(request, 'end')
 
 
 class RoomsPlayingView(views.APIView):
     """
     List Movie rooms and their showtimes
     """
+    ordering = ('object_id',)
+
     def get(self, request):
         """
-        Build the object to get the rooms and showtimes
+        Build the object to get the rooms and showtimes, read from the precomputed playing snapshots: a 304
+        when nothing changed (see ticket_office.conditional), otherwise one query for the page of room ids and
+        one for their listings
 
         :param request:
         :return:
         """
-        rooms = Room.objects.all()
-        start = request.query_params.get('start', dt.datetime.now())
-        end = request.query_params.get('end')
-        results = []
-        for room in rooms:
-            qstart = Showtime.objects.filter(room=room.id, start_date__gte=start)
-            query = Showtime.objects.filter(room=room.id, start_date__gte=start, start_date__lte=end) if end else qstart
-            results.append({'name': room.name,
-                            'capacity': room.capacity,
-                            'showtimes': query})
+        start, end = playing_window(request)
+        return conditional.respond(request, lambda: self.listing(request, start, end),
+                                   conditional.clock_version(start, end))
 
-        serializer = RoomsPlayingSerializer({'rooms': results})
-        return Response(serializer.data)
+    def listing(self, request, start, end):
+        """
+        :param request:
+        :param datetime start: start of the window
+        :param datetime end: end of the window, None for no limit
+        :return: response with the page of rooms
+        """
+        first, last = snapshots.window_days(start, end)
+        room_ids = PlayingSnapshot.objects.filter(kind=PlayingSnapshot.ROOM, day__gte=first)
+        if last is not None:
+            room_ids = room_ids.filter(day__lte=last)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(room_ids.values('object_id').distinct(), request, view=self)
+
+        rooms = [{'name': room['name'], 'capacity': room['size'], 'showtimes': room['showtimes']}
+                 for room in snapshots.playing(PlayingSnapshot.ROOM, [row['object_id'] for row in page], start, end)]
+        serializer = RoomsPlayingSerializer({'rooms': rooms})
+        return Response(OrderedDict([('next', paginator.get_next_link())], **serializer.data))
 
 
 class MoviesPlayingView(views.APIView):
     """
     List Movies and their showtimes
     """
+    ordering = ('object_id',)
+
     def get(self, request):
         """
-        Build the object to get the rooms and showtimes
+        Build the object to get the movies and showtimes, read from the precomputed playing snapshots: a 304
+        when nothing changed (see ticket_office.conditional), otherwise one query for the page of movie ids and
+        one for their listings
 
         :param request:
         :return:
         """
-        movies = Movie.objects.all()
-        start = request.query_params.get('start', dt.datetime.now())
-        end = request.query_params.get('end')
-        results = []
-        for movie in movies:
-            qstart = Showtime.objects.filter(movie=movie.id, start_date__gte=start)
-            query = Showtime.objects.filter(movie=movie.id, start_date__gte=start, start_date__lte=end) if end else qstart
-            results.append({'title': movie.title,
-                            'duration': movie.duration,
-                            'showtimes': query})
+        start, end = playing_window(request)
+        return conditional.respond(request, lambda: self.listing(request, start, end),
+                                   conditional.clock_version(start, end))
 
-        serializer = MoviesPlayingSerializer({'movies': results})
-        return Response(serializer.data)
+    def listing(self, request, start, end):
+        """
+        :param request:
+        :param datetime start: start of the window
+        :param datetime end: end of the window, None for no limit
+        :return: response with the page of movies
+        """
+        first, last = snapshots.window_days(start, end)
+        movie_ids = PlayingSnapshot.objects.filter(kind=PlayingSnapshot.MOVIE, day__gte=first)
+        if last is not None:
+            movie_ids = movie_ids.filter(day__lte=last)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(movie_ids.values('object_id').distinct(), request, view=self)
+
+        movies = [{'title': movie['name'], 'duration': movie['size'], 'showtimes': movie['showtimes']}
+                  for movie in snapshots.playing(PlayingSnapshot.MOVIE, [row['object_id'] for row in page], start, end)]
+        serializer = MoviesPlayingSerializer({'movies': movies})
+        return Response(OrderedDict([('next', paginator.get_next_link())], **serializer.data))
+
+
+class OccupancyView(views.APIView):
+    """
+    Showtimes, seats on sale, seats sold, tickets and fill rate per room, movie or business day
+    """
+    group = None
+
+    def get(self, request):
+        """
+        Sum the figures of the business days from start_day to end_day (both optional and included) with
+        grouped queries, see ticket_office.analytics
+
+        :param request:
+        :return:
+        """
+        from ticket_office import analytics
+        first, last = query_day(request, 'start_day'), query_day(request, 'end_day')
+        return Response({self.group + 's': analytics.occupancy(self.group, first, last)})
+
+
+class TopMoviesView(views.APIView):
+    """
+    Movies that sold the most tickets
+    """
+
+    def get(self, request):
+        """
+        Rank the movies by tickets sold on the business days from start_day to end_day, the first ?limit=
+        (10 by default)
+
+        :param request:
+        :return:
+        """
+        from ticket_office import analytics
+        first, last = query_day(request, 'start_day'), query_day(request, 'end_day')
+        limit = query_number(request, 'limit', minimum=1)
+        return Response({'movies': analytics.top_movies(first, last, limit or 10)})
+
+
+class CacheStatsView(views.APIView):
+    """
+    Hit ratio of the read-through cache
+    """
+    def get(self, request):
+        return Response(stats())
+
+
+def metrics_view(request):
+    """
+    Request metrics and cache hit ratio in the Prometheus text format
+
+    :param request:
+    :return:
+    """
+    cache_stats = stats()
+    extra = [
+        '# HELP ticket_office_cache_requests_total Read-through cache lookups',
+        '# TYPE ticket_office_cache_requests_total counter',
+        'ticket_office_cache_requests_total{{result="hit"}} {}'.format(cache_stats['hits']),
+        'ticket_office_cache_requests_total{{result="miss"}} {}'.format(cache_stats['misses']),
+    ]
+    return HttpResponse(metrics.render(extra), content_type='text/plain; version=0.0.4; charset=utf-8')